@@ -1,5 +1,6 @@
 """Chat API - No repetitive code"""
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from database import get_db
 from schemas import ChatMessage, ChatResponse, ConfirmationRequest
@@ -23,6 +24,33 @@ def _get_archive_table_name(table_name: str) -> str:
     else:
         return f"{table_name}archive"  # Fallback for other tables
 
+def _chat_token(current_user: Optional[Dict]) -> Optional[str]:
+    """Create a simple token representation of the current user for the chat service"""
+    if not current_user:
+        return None
+    from services.auth_service import AuthService
+    auth_service = AuthService()
+    return auth_service.create_access_token(current_user)
+
+def _validate_chat_region(region: Optional[str]) -> None:
+    """Reject a requested region that does not exist or is not connected"""
+    if not region:
+        return
+    from services.region_service import get_region_service
+    region_service = get_region_service()
+    
+    if region not in region_service.get_available_regions():
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Invalid region: {region}. Available: {region_service.get_available_regions()}"
+        )
+    
+    if not region_service.is_connected(region):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Not connected to region: {region}. Please connect first."
+        )
+
 @router.post("", response_model=ChatResponse)
 async def chat_with_agent(
     message: ChatMessage,
@@ -32,29 +60,8 @@ async def chat_with_agent(
     """Main chat endpoint with region and table support"""
     try:
         # Extract token for chat service (legacy support)
-        token = None
-        if current_user:
-            # Create a simple token representation for the chat service
-            from services.auth_service import AuthService
-            auth_service = AuthService()
-            token = auth_service.create_access_token(current_user)
-        
-        # Validate region if provided
-        if message.region:
-            from services.region_service import get_region_service
-            region_service = get_region_service()
-            
-            if message.region not in region_service.get_available_regions():
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Invalid region: {message.region}. Available: {region_service.get_available_regions()}"
-                )
-            
-            if not region_service.is_connected(message.region):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not connected to region: {message.region}. Please connect first."
-                )
+        token = _chat_token(current_user)
+        _validate_chat_region(message.region)
         
         chat_service = ChatService()
         return await chat_service.process_chat(
@@ -71,6 +78,37 @@ async def chat_with_agent(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
 
+@router.post("/stream")
+async def stream_chat_reply(
+    message: ChatMessage,
+    db: Session = Depends(get_db),
+    current_user: Optional[Dict] = Depends(get_current_user_optional)
+):
+    """Chat endpoint that streams conversational replies as plain text while the LLM generates them.
+    
+    Messages are routed, logged and validated exactly like the main chat endpoint; database
+    operations and other non-conversational answers arrive as one complete chunk.
+    """
+    try:
+        token = _chat_token(current_user)
+        _validate_chat_region(message.region)
+        
+        chat_service = ChatService()
+        chunks = await chat_service.process_chat_stream(
+            user_message=message.message,
+            db=db,
+            user_token=token,
+            session_id=message.session_id,
+            user_id=message.user_id,
+            region=message.region
+        )
+        return StreamingResponse(chunks, media_type="text/plain")
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chat streaming failed: {str(e)}")
+
 @router.post("/confirm", response_model=ChatResponse)
 async def confirm_operation(
     confirmation: ConfirmationRequest,
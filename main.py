@@ -14,6 +14,7 @@ from database import test_connection, Base, engine
 from api import chat_router
 from api.auth import router as auth_router
 from api.regions import router as regions_router
+from services.llm_service import close_http_client
 
 # Create tables
 try:
@@ -56,6 +57,10 @@ async def lifespan(app: FastAPI):
         raise Exception("Database connection failed")
     
     yield
+    
+    # Shutdown
+    await close_http_client()
+    logger.info("OpenAI HTTP client closed")
 
 # Initialize FastAPI
 app = FastAPI(
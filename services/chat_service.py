@@ -2,11 +2,12 @@
 from sqlalchemy.orm import Session
 from schemas import ChatResponse
 from models import ChatOpsLog
+from database import SessionLocal
 import re
 from datetime import datetime, timedelta
 import logging
-from typing import List, Dict, Any
-from .llm_service import OpenAIService
+from typing import List, Dict, Any, Optional, Union, AsyncIterator
+from .llm_service import OpenAIService, EnhancedLLMResult, invalidate_table_stats_cache
 from .auth_service import AuthService
 from schemas import ParsedOperation
 from .crud_service import CRUDService
@@ -15,6 +16,11 @@ from utils.json_serializer import prepare_filters_for_storage
 
 logger = logging.getLogger(__name__)
 
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    """Wrap a complete reply as a one-chunk stream"""
+    yield text
+
+
 class ChatService:
     def __init__(self):
         self.llm_service = OpenAIService()
@@ -28,9 +34,14 @@ class ChatService:
         user_token: str = None,
         session_id: str = None,
         user_id: str = None,
-        region: str = None
-    ) -> ChatResponse:
-        """Process chat with hybrid routing, region validation, and role-based operations"""
+        region: str = None,
+        stream: bool = False
+    ) -> Union[ChatResponse, AsyncIterator[str]]:
+        """Process chat with hybrid routing, region validation, and role-based operations.
+        
+        With stream=True a conversational reply is returned as an async iterator of text
+        chunks instead of a ChatResponse; every other branch still returns a ChatResponse.
+        """
         try:
             # Authenticate user if token provided
             user_info = None
@@ -191,18 +202,18 @@ class ChatService:
                     else:
                         # LLM result exists but no valid MCP operation - fall back to conversational
                         return await self._handle_conversational(
-                            user_message, user_info, db, chat_log, region, final_session_id
+                            user_message, user_info, db, chat_log, region, final_session_id, stream
                         )
                 else:
                     # No LLM result - conversational response
                     return await self._handle_conversational(
-                        user_message, user_info, db, chat_log, region, final_session_id
+                        user_message, user_info, db, chat_log, region, final_session_id, stream
                     )
             except Exception as e:
                 logger.error(f"LLM processing failed: {e}")
                 # Fallback to conversational
                 return await self._handle_conversational(
-                    user_message, user_info, db, chat_log, region, final_session_id
+                    user_message, user_info, db, chat_log, region, final_session_id, stream
                 )
                 
         except Exception as e:
@@ -271,8 +282,9 @@ class ChatService:
         db: Session, 
         chat_log: ChatOpsLog,
         region: str,
-        session_id: str = None
-    ) -> ChatResponse:
+        session_id: str = None,
+        stream: bool = False
+    ) -> Union[ChatResponse, AsyncIterator[str]]:
         """Handle conversational messages using LLM without database operations"""
         try:
             # Use provided session_id or get from chat_log
@@ -286,6 +298,12 @@ class ChatService:
             if self._is_greeting_message(user_message):
                 return self._create_welcome_response(user_id, user_role, region)
             
+            if stream:
+                # The reply is logged once it has been streamed in full
+                return self._stream_conversational_reply(
+                    user_message, user_id, conversation_history, chat_log.id if chat_log else None
+                )
+            
             # Generate conversational response using OpenAI
             llm_response = await self.llm_service.generate_response(
                 user_message=user_message,
@@ -326,6 +344,67 @@ class ChatService:
                 structured_content=error_structured_content
             )
 
+    async def process_chat_stream(
+        self,
+        user_message: str,
+        db: Session,
+        user_token: str = None,
+        session_id: str = None,
+        user_id: str = None,
+        region: str = None
+    ) -> AsyncIterator[str]:
+        """Process chat like process_chat and return the reply as an async iterator of text chunks.
+        
+        Routing, operations and logging run before this returns, while the request's database
+        session is open; only a conversational LLM reply is streamed as it is generated.
+        Database operations, clarifications and greetings arrive as one complete chunk.
+        """
+        result = await self.process_chat(
+            user_message=user_message,
+            db=db,
+            user_token=user_token,
+            session_id=session_id,
+            user_id=user_id,
+            region=region,
+            stream=True
+        )
+        if isinstance(result, ChatResponse):
+            return _single_chunk(result.response)
+        return result
+
+    async def _stream_conversational_reply(
+        self,
+        user_message: str,
+        user_id: str,
+        conversation_history: str,
+        chat_log_id: Optional[int]
+    ) -> AsyncIterator[str]:
+        """Stream a conversational LLM reply, then store it on the turn's chat log"""
+        streamed = []
+        async for chunk in self.llm_service.stream_response(
+            user_message=user_message,
+            user_id=user_id,
+            conversation_context=conversation_history
+        ):
+            streamed.append(chunk)
+            yield chunk
+        
+        if chat_log_id is None:
+            return
+        # The request's session is closed once the response starts, so the log gets its own
+        db = SessionLocal()
+        try:
+            db.query(ChatOpsLog).filter(ChatOpsLog.id == chat_log_id).update({
+                "bot_response": "".join(streamed).strip(),
+                "operation_status": "conversational"
+            })
+            db.commit()
+        except Exception as e:
+            logger.error(f"Failed to store streamed reply for chat log {chat_log_id}: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
     async def _format_response_by_tool(self, llm_result, region: str, session_id: str = None, user_info: dict = None) -> ChatResponse:
         """Format response based on the MCP tool used by LLM"""
         try:
@@ -903,16 +982,9 @@ class ChatService:
                 
                 # Execute archive operation
                 mcp_result = await archive_records(table_name, filters, "system")
+                invalidate_table_stats_cache()
                 
-                # Create mock LLM result structure
-                class MockLLMResult:
-                    def __init__(self, tool, table, filters, result):
-                        self.tool_used = tool
-                        self.table_used = table
-                        self.filters = filters
-                        self.mcp_result = result
-                
-                return MockLLMResult("archive_records", table_name, filters, mcp_result)
+                return EnhancedLLMResult("archive_records", table_name, filters, mcp_result)
                 
             elif "CONFIRM DELETE" in message_upper:
                 # CRITICAL FIX: Use the stored table name from the preview operation
@@ -940,25 +1012,16 @@ class ChatService:
                 
                 # Execute delete operation
                 mcp_result = await delete_archived_records(table_name, filters, "system")
+                invalidate_table_stats_cache()
                 
-                # Create mock LLM result structure
-                class MockLLMResult:
-                    def __init__(self, tool, table, filters, result):
-                        self.tool_used = tool
-                        self.table_used = table
-                        self.filters = filters
-                        self.mcp_result = result
-                
-                return MockLLMResult("delete_archived_records", table_name, filters, mcp_result)
+                return EnhancedLLMResult("delete_archived_records", table_name, filters, mcp_result)
                 
             else:
                 logger.warning(f"Unknown confirmation type: {message_upper}")
                 return None
             
         except Exception as e:
-            logger.error(f"Error in stored confirmation execution: {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception(f"Error in stored confirmation execution: {e}")
             return None
 
     def _extract_table_names_from_sql(self, sql_query: str) -> List[str]:
@@ -2149,8 +2212,6 @@ class ChatService:
     ) -> str:
         """Use LLM to generate intelligent, contextual response for SQL query results"""
         try:
-            from services.llm_service import OpenAIService
-            
             llm_service = OpenAIService()
             
             # Prepare data summary for LLM (limit data size to avoid token limits)
@@ -1,24 +1,1328 @@
 """LLM service for intelligent chat responses"""
 import os
+import re
+import asyncio
+import copy
+import hashlib
 import json
+import time
 import logging
-import requests
-from typing import Optional, Dict, Any, List
+from collections import OrderedDict
+from contextlib import aclosing, contextmanager
+from dataclasses import dataclass, field
+import httpx
+import orjson
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, Mapping, Tuple, Callable, Awaitable, AsyncIterator, Iterator, Final
 from dotenv import load_dotenv
+from .region_service import get_region_service
+from .database_service import DatabaseService
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Database / stats / archive vocabulary - turns mentioning any of these get deterministic sampling
+_FACTUAL_INTENT_RE = re.compile(
+    r"count|stat|archive|delete|table|database|record|activit|transaction|"
+    r"job|region|health|sql|select|query|how many|total|older than"
+)
+
+# Greetings and acknowledgements that never map to a database operation
+_TRIVIAL_RE = re.compile(r"^\s*(hi|hello|hey|thanks|thank you|ok|okay)\s*[!.?]*\s*$", re.IGNORECASE)
+# Chit-chat that makes up the whole message, so "hello, show me errors" is not matched
+_CHIT_CHAT_RE = re.compile(
+    r"^\s*(?:hi|hello|hey|good (?:morning|afternoon|evening)|help|what can you do|who are you|"
+    r"what(?:'s| is) (?:the )?(?:today'?s )?(?:date|time)(?: today| now)?)\s*[!.?]*\s*$",
+    re.IGNORECASE
+)
+# Off-topic subjects; only trusted when no data vocabulary is present ("errors from the news service")
+_OFF_TOPIC_RE = re.compile(r"\b(?:weather|news|recipes?|movies?|stocks?|sports|jokes?)\b", re.IGNORECASE)
+_CONVERSATIONAL_RE = re.compile(f"{_CHIT_CHAT_RE.pattern}|{_OFF_TOPIC_RE.pattern}", re.IGNORECASE)
+# Schema-destroying requests the agent refuses; archived-record deletes are not matched
+_DESTRUCTIVE_RE = re.compile(
+    r"\b(?:drop (?:the )?(?:table|database)|truncate (?:the )?table|"
+    r"(?:delete|remove) (?:the )?(?:entire |whole )?database)\b",
+    re.IGNORECASE
+)
+# Questions about what an operation or policy means; the conversational handler explains them,
+# unless the question also asks for data (counts, failures, job analysis and the like)
+_POLICY_RE = re.compile(
+    r"^\s*(?:what does\b.*\bmean|(?:can you )?explain\b|how does\b.*\bwork|"
+    r"(?:what(?:'s| is| are)|tell me about|describe) (?:the |your |our )?(?:\w+ ){0,3}polic(?:y|ies)\b|"
+    r"(?:\w+ ){0,2}polic(?:y|ies)\s*\?*\s*$)",
+    re.IGNORECASE
+)
+_POLICY_EXCLUSION_RE = re.compile(
+    r"count|how many|total|stat|older than|fail|error|why|job|show|list|where|region|sql|query"
+)
+# Broader data vocabulary; without any of it (and without history) a message cannot be a tool call
+_DATA_HINT_RE = re.compile(
+    _FACTUAL_INTENT_RE.pattern + r"|error|fail|succe|warn|exception|timeout|data|log|server|event|"
+    r"show|list|find|purge|remove|clean|old|recent|yesterday|today|week|month|year"
+)
+
+
+def _is_non_database_message(user_message: str, has_context: bool) -> bool:
+    """True when a message can be answered without routing it to a database tool.
+
+    Covers greetings and clock questions that make up the whole message, schema-destroying
+    requests, questions about what a policy means, off-topic subjects with no data vocabulary
+    and, without history, anything lacking data vocabulary altogether - acknowledgements such as
+    "ok" included, since with history they can confirm a pending preview.
+    """
+    user_msg_lower = user_message.lower()
+    if _CHIT_CHAT_RE.match(user_message) or _DESTRUCTIVE_RE.search(user_message):
+        return True
+    if _POLICY_RE.search(user_message) and not _POLICY_EXCLUSION_RE.search(user_msg_lower):
+        return True
+    has_data_hint = _DATA_HINT_RE.search(user_msg_lower) is not None
+    if _OFF_TOPIC_RE.search(user_message) and not has_data_hint:
+        return True
+    return not has_context and not has_data_hint
+
+
+def _phrase_union(phrases: Tuple[str, ...]) -> "re.Pattern[str]":
+    """Compile literal phrases into one alternation that matches any of them as a substring"""
+    return re.compile("|".join(re.escape(phrase) for phrase in phrases))
+
+
+# Fallback intent phrase sets, each scanned in one pass
+_EXPLANATION_RE = _phrase_union((
+    'what does', 'what is', 'explain', 'how does', 'policy', 'means what',
+    'for how much', 'can you explain'
+))
+_ARCHIVE_OPERATION_RE = _phrase_union((
+    'archive records', 'archive old data', 'start archive',
+    'archive activities', 'archive transactions', 'archive old records'
+))
+_STATS_JOB_EXCLUSION_RE = _phrase_union((
+    'job logs', 'job log', 'jobs', 'job execution', 'job status',
+    'job failure', 'job success', 'job summary', 'job statistics'
+))
+_STATS_PHRASE_RE = _phrase_union((
+    # Main table counting
+    'count activities', 'activities count', 'total activities',
+    'count transactions', 'transactions count', 'total transactions',
+    'table statistics', 'database statistics', 'show table stats',
+    'database overview', 'table summary',
+    # Archived table counting
+    'count of archived activities', 'archived activities count', 'total archived activities',
+    'count of archived transactions', 'archived transactions count', 'total archived transactions',
+    'count archived activities', 'count archived transactions',
+    'archived activities statistics', 'archived transactions statistics',
+    'show archived activities count', 'show archived transactions count',
+    # Flexible counting with "of"
+    'count of activities', 'count of transactions',
+    'total count of activities', 'total count of transactions',
+    # Database overview
+    'overview of all database tables', 'overview of database tables', 'all database tables'
+))
+_STATS_DATE_PHRASE_RE = _phrase_union((
+    'activities older than', 'transactions older than',
+    'activities from', 'transactions from',
+    'recent activities', 'recent transactions',
+    'activities in', 'transactions in',
+    'activities between', 'transactions between',
+    'activities last', 'transactions last',
+    'activities this', 'transactions this'
+))
+_ANALYSIS_RE = _phrase_union(('analyse', 'analyze', 'why', 'reason'))
+
+# Fallback response intents; greetings are whole words so "hi" no longer matches "archive" or "this"
+_FALLBACK_GREETING_RE = re.compile(r"\b(?:hello|hi|hey|good\s+morning|good\s+afternoon)\b")
+_FALLBACK_HELP_RE = _phrase_union(('help', 'what can you do', 'capabilities', 'features'))
+_FALLBACK_DATABASE_RE = _phrase_union(('show', 'data', 'table', 'database', 'stats', 'count', 'archive'))
+_FALLBACK_TOPIC_RE = _phrase_union(('log', 'data', 'table', 'database', 'activity', 'transaction', 'archive'))
+
+# Job-log request detection; exact phrases match the whole message or lead it as a word
+_JOB_EXACT_PATTERNS = frozenset({
+    'show jobs', 'list jobs', 'job logs', 'recent jobs',
+    'last job', 'latest job', 'job statistics', 'job summary',
+    'failed jobs', 'successful jobs', 'job status'
+})
+_JOB_EXACT_PREFIXES = tuple(pattern + ' ' for pattern in _JOB_EXACT_PATTERNS)
+_JOB_PHRASE_RE = _phrase_union((
+    # Job counting
+    'how many job logs', 'count job logs', 'job logs count', 'total job logs',
+    'how many jobs', 'count jobs', 'jobs count', 'total jobs',
+    'number of job logs', 'number of jobs',
+    # Job analysis
+    'job failure analysis', 'job fail analysis', 'analyse job fail', 'analyze job fail',
+    'job failure reasons', 'why jobs fail', 'job error analysis', 'job issue analysis'
+))
+_JOB_COUNT_WORD_RE = _phrase_union(('how many', 'count', 'total', 'number of'))
+_JOB_ANALYSIS_WORD_RE = _phrase_union(('analys', 'reason', 'why', 'cause', 'fail'))
+_JOB_STATS_WORD_RE = _phrase_union(('statistics', 'summary', 'stats'))
+
+# Conversation-context patterns
+_CONTEXT_TURN_RE = re.compile(r"^[ \t]*(User|Assistant): (.*\S)[ \t\r]*$", re.MULTILINE)
+_CONTEXT_TURN_ROLES = {"User": "user", "Assistant": "assistant"}
+_OLDER_THAN_RE = re.compile(r"older than (\d+) (day|month|year)s?")
+_JOB_TYPE_RE = re.compile(r"job_type: ([^,\]]+)")
+_STATUS_RE = re.compile(r"status: ([^,\]]+)")
+_TABLES_RE = re.compile(r"tables: ([^,\]]+)")
+_DATE_RANGE_RE = re.compile(r"date_range: ([^,\]]+)")
+_JOB_TYPES_RE = re.compile(r"job_types: ([^,\]]+)")
+# Longest names first so archive tables win over their main-table prefix
+_CONTEXT_TABLE_RE = re.compile(r"dsitransactionlogarchive|dsiactivitiesarchive|dsitransactionlog|dsiactivities|job_logs")
+
+# Table-related tokens in a user message, folded into a bitmask (one bit per token)
+_TABLE_TOKENS = ("dsitransactionlogarchive", "dsiactivitiesarchive", "dsitransactionlog", "dsiactivities",
+                 "transaction", "activit", "archive")
+_TABLE_TOKEN_BITS = {token: 1 << index for index, token in enumerate(_TABLE_TOKENS)}
+_MSG_TOKENS_RE = re.compile("|".join(_TABLE_TOKENS))
+# Tokens embedded in a longer table name are implied by it
+_ARCHIVE_MASK = sum(_TABLE_TOKEN_BITS[t] for t in ("archive", "dsitransactionlogarchive", "dsiactivitiesarchive"))
+_TRANSACTION_MASK = sum(_TABLE_TOKEN_BITS[t] for t in ("transaction", "dsitransactionlog", "dsitransactionlogarchive"))
+_ACTIVITY_MASK = sum(_TABLE_TOKEN_BITS[t] for t in ("activit", "dsiactivities", "dsiactivitiesarchive"))
+
+
+def _table_for_mask(mask: int) -> Optional[str]:
+    """Resolve the table a message names explicitly, or None when it names no table"""
+    has_archive = bool(mask & _ARCHIVE_MASK)
+    
+    if mask & _TABLE_TOKEN_BITS["dsitransactionlogarchive"]:
+        return "dsitransactionlogarchive"
+    elif mask & _TABLE_TOKEN_BITS["dsiactivitiesarchive"]:
+        return "dsiactivitiesarchive"
+    elif mask & _TABLE_TOKEN_BITS["dsitransactionlog"] and not has_archive:
+        return "dsitransactionlog"
+    elif mask & _TABLE_TOKEN_BITS["dsiactivities"] and not has_archive:
+        return "dsiactivities"
+    
+    # Fresh requests that mention a table type use the main table unless archive is mentioned
+    if mask & _TRANSACTION_MASK:
+        return "dsitransactionlogarchive" if has_archive else "dsitransactionlog"
+    elif mask & _ACTIVITY_MASK:
+        return "dsiactivitiesarchive" if has_archive else "dsiactivities"
+    return None
+
+
+# Every token combination resolved up front, so a lookup replaces the branch chain
+_MASK_TO_TABLE = {mask: _table_for_mask(mask) for mask in range(1 << len(_TABLE_TOKENS))}
+
+# Non-date filter phrases, matched as substrings in one scan
+_FILTER_PHRASE_RE = _phrase_union((
+    'where', 'like', 'containing', 'specific', 'particular', 'activitytype',
+    'servername', 'by server', 'with error', 'status', 'type', 'contains',
+    'equals', 'is event', 'is error', 'name like', 'server like',
+    'activity type', 'transaction type', 'error type', 'where activitytype',
+    'where servername', 'where status', 'where type'
+))
+# Non-date filter vocabulary, matched at the start of a word so inflected and hyphenated forms
+# ("errored", "error-prone") count while the keyword is never found mid-word
+_FILTER_KEYWORD_RE = re.compile(r"\b(?:" + "|".join((
+    'error', 'failed', 'success', 'warning', 'exception', 'timeout', 'cancelled', 'canceled',
+    'completed', 'pending', 'running', 'stopped', 'paused', 'retry', 'retries'
+)) + r")\w*")
+# Filtering-context words, matched as whole words after punctuation is blanked out
+_FILTER_CONTEXT_WORDS = frozenset({'count', 'show', 'list', 'find', 'get', 'all', 'only', 'with'})
+_PUNCT_TO_SPACE = str.maketrans({char: ' ' for char in '.,;:!?()[]{}"\'`/'})
+
+# Date filter patterns
+_YEAR_RE = re.compile(r'\b(20\d{2})\b')
+_MONTH_NAMES = ('january', 'february', 'march', 'april', 'may', 'june',
+                'july', 'august', 'september', 'october', 'november', 'december')
+_MONTH_ORDER = {month: index for index, month in enumerate(_MONTH_NAMES)}
+_MONTH_RE = re.compile(r'\b(?:' + '|'.join(_MONTH_NAMES) + r')\b')
+# Any date-related word (months included, plurals allowed) means the LLM date filter should parse it;
+# whole words only, so "to" and "day" no longer match inside "tomorrowland" or "player"
+_DATE_KEYWORD_RE = re.compile(r'\b(?:' + '|'.join(_MONTH_NAMES + (
+    'last', 'past', 'recent', 'recently', 'older', 'newer', 'yesterday', 'today',
+    'week', 'month', 'year', 'day', 'quarter', 'season', 'holiday',
+    'ago', 'before', 'after', 'since', 'from', 'to', 'between',
+    'this', 'current', 'previous', 'fiscal', 'maintenance', 'busy'
+)) + r')s?\b')
+# Table nouns dropped from a message before it is handed to the LLM date filter
+_DATE_FILTER_NOISE_WORDS = ('transactions', 'activities', 'records', 'data', 'logs')
+_CUSTOM_DATE_RANGE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'september\s+\d+\s+to\s+september\s+\d+',  # "september 15 to september 30"
+    r'from\s+september\s+\d+\s+to\s+september\s+\d+',  # "from september 15 to september 30"
+    r'\d+/\d+\s+(?:and|to)\s+\d+/\d+',  # "9/15 and 9/30" or "9/15 to 9/30"
+    r'between\s+\d+/\d+\s+and\s+\d+/\d+',  # "between 9/15 and 9/30"
+    r'get\s+all\s+jobs\s+between\s+\d+/\d+\s+and\s+\d+/\d+',  # "get all jobs between 9/15 and 9/30"
+    r'october\s+\d+\s+to\s+october\s+\d+',  # "october 1 to october 3"
+    r'from\s+october\s+\d+\s+to\s+october\s+\d+',  # "from october 1 to october 3"
+    r'from\s+\d+/\d+\s+to\s+\d+/\d+',  # "from 9/15 to 9/30"
+    r'jobs\s+from\s+\d+/\d+\s+to\s+\d+/\d+',  # "jobs from 9/15 to 9/30"
+))
+_SEPTEMBER_RANGE_RE = re.compile(r'(?:from\s+)?september\s+(\d+)\s+to\s+september\s+(\d+)')
+_NUMERIC_RANGE_RE = re.compile(r'(?:between\s+|from\s+)?(\d+)/(\d+)\s+(?:and|to)\s+(\d+)/(\d+)')
+_OCTOBER_RANGE_RE = re.compile(r'(?:from\s+)?october\s+(\d+)\s+to\s+october\s+(\d+)')
+_JOBS_NUMERIC_RANGE_RE = re.compile(r'jobs\s+from\s+(\d+)/(\d+)\s+to\s+(\d+)/(\d+)')
+# (pattern, date_range template) in priority order; positional slots are the match groups
+_CUSTOM_DATE_RANGE_RULES = (
+    (_SEPTEMBER_RANGE_RE, "from_9/{0}/{year}_to_9/{1}/{year}"),  # "september 15 to september 30"
+    (_NUMERIC_RANGE_RE, "from_{0}/{1}/{year}_to_{2}/{3}/{year}"),  # "9/15 and 9/30", "between 9/15 and 9/30"
+    (_OCTOBER_RANGE_RE, "from_10/{0}/{year}_to_10/{1}/{year}"),  # "october 1 to october 3"
+    (_JOBS_NUMERIC_RANGE_RE, "from_{0}/{1}/{year}_to_{2}/{3}/{year}"),  # "jobs from M/D to M/D"
+)
+
+# SQL table extraction patterns
+_SQL_FROM_RE = re.compile(r'\bFROM\s+([a-zA-Z_][a-zA-Z0-9_]*)')
+_SQL_JOIN_RE = re.compile(r'\b(?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN\s+([a-zA-Z_][a-zA-Z0-9_]*)')
+_KNOWN_SQL_TABLES = frozenset({
+    'dsiactivities', 'dsitransactionlog', 'job_logs',
+    'dsiactivitiesarchive', 'dsitransactionlogarchive'
+})
+
+# The two routes the LLM returns most often; replies starting with these are carved directly
+_PFX_STATS = "MCP_TOOL: get_table_stats "
+_PFX_ARCH = "MCP_TOOL: archive_records "
+
+
+# Static instructions for parse_with_enhanced_tools. Kept byte-identical across calls and sent
+# as the leading system message so the provider can reuse its cached prompt prefix.
+_ENHANCED_PROMPT_PREFIX = """You are an expert database operations agent. Analyze user requests using natural language understanding and conversational context.
+
+Available Database Tables:
+- dsiactivities: Main activity logs (current records)
+- dsitransactionlog: Main transaction logs (current records)
+- dsiactivitiesarchive: Archived activity logs (old records)
+- dsitransactionlogarchive: Archived transaction logs (old records)
+
+Available MCP Tools:
+1. get_table_stats - For counting records and table statistics with date filters
+2. archive_records - For archiving old records (7+ days old) from main tables to archive tables
+3. delete_archived_records - For deleting old archived records (30+ days old) from archive tables
+4. health_check - For system health/status checks
+5. region_status - For region connection status and current region info
+6. execute_sql_query - For custom SQL queries using natural language (includes ALL job queries and complex conditions)
+
+CRITICAL ANALYSIS RULES:
+
+1. STATISTICS/COUNTING QUERIES (USE get_table_stats):
+- "count activities", "activities count", "total activities" -> get_table_stats
+- "count transactions", "transactions count", "total transactions" -> get_table_stats
+- "activities older than X days/months" -> get_table_stats with date_filter
+- "transactions older than X days/months" -> get_table_stats with date_filter
+- "count of archived activities", "archived activities count" -> get_table_stats
+- "count of archived transactions", "archived transactions count" -> get_table_stats
+- "table statistics", "database statistics", "show table stats" -> get_table_stats
+- Simple counting queries with ONLY date filters (no other filters) -> get_table_stats
+
+IMPORTANT: If the query has ANY filters other than date filters (like ActivityType, ServerName, specific field values, WHERE conditions), use execute_sql_query instead!
+
+2. JOB QUERIES (USE execute_sql_query):
+- "show jobs", "list jobs", "recent jobs", "latest jobs" -> execute_sql_query
+- "failed jobs", "successful jobs", "job status" -> execute_sql_query
+- "job statistics", "job summary", "job stats" -> execute_sql_query
+- "archive jobs", "delete jobs" (about job execution logs, not data) -> execute_sql_query
+- "jobs from last week", "jobs today", "recent job executions" -> execute_sql_query
+- ALL job-related queries should use execute_sql_query for maximum flexibility
+- Job queries target the job_logs table via SQL generation
+- ANALYSIS/REASONING queries about jobs -> execute_sql_query (e.g., "analyse job fail", "why jobs fail", "job failure reasons")
+
+3. ARCHIVE OPERATIONS (USE archive_records):
+- "archive activities", "archive old activities", "archive activities older than X" -> archive_records
+- "archive transactions", "archive old transactions", "archive transactions older than X" -> archive_records
+- Must be clear operational intent for moving data to archive tables
+
+4. DELETE OPERATIONS (USE delete_archived_records):
+- "delete archived activities", "delete old archived activities" -> delete_archived_records
+- "delete archived transactions", "delete old archived transactions" -> delete_archived_records
+- Must be clear operational intent for permanently removing archived data
+
+5. REGION QUERIES (USE region_status):
+- EXACT phrases: "region status", "current region", "which region", "region info" -> region_status
+- Must be specifically about region/connection status
+
+6. CUSTOM SQL QUERIES (USE execute_sql_query - FOR NON-DATE FILTERS & COMPLEX CONDITIONS):
+- ANY count/list queries with non-date filters -> execute_sql_query
+- Queries with status/condition keywords: "errors", "failed", "successful", "warnings", "exceptions", "timeout" -> execute_sql_query
+- "count all errors in transactions" -> execute_sql_query
+- "show failed activities" -> execute_sql_query
+- "count successful transactions" -> execute_sql_query
+- "list all warnings" -> execute_sql_query
+- "count activities where ActivityType = 'Event'" -> execute_sql_query
+- "list activities by server" -> execute_sql_query
+- "count transactions with specific criteria" -> execute_sql_query
+- "activities where ServerName contains 'prod'" -> execute_sql_query
+- Complex WHERE conditions with multiple criteria -> execute_sql_query
+- Queries with specific field matching (e.g., ActivityType = 'Event') -> execute_sql_query
+- JOIN operations or multi-table queries -> execute_sql_query
+- ANALYSIS queries (why, analyse, reason, cause) -> execute_sql_query
+- "show activities where ActivityType is Event", "find records with...", "activities by server" -> execute_sql_query
+- "list transactions where...", "get data with specific criteria", "filter by multiple conditions" -> execute_sql_query
+- "analyse job fail", "why jobs fail", "job failure reasons" -> execute_sql_query
+- Any queries with filters beyond simple date filtering -> execute_sql_query
+
+CONTEXT HANDLING (CRITICAL):
+- PRESERVE context from previous queries for follow-up requests
+- "archive them", "delete them", "count them" -> Use EXACT table + filters from previous query
+- Archive context preservation: After "archived X" query, follow-ups stay on archive table
+
+TABLE SELECTION LOGIC:
+- NEW explicit requests: "count transactions" -> dsitransactionlog (main table)
+- CONTEXTUAL references: Use previous table from conversation
+- Archive preservation: "archived X" context + follow-up -> keep archive table
+
+DATE FILTER PARSING (LLM-Enhanced):
+- Use natural language date expressions directly in date_filter
+- "transactions in month of january" -> {"date_filter": "january"}
+- "older than 10 months" -> {"date_filter": "older than 10 months"}
+- "from last year" -> {"date_filter": "last year"}
+- "yesterday's activities" -> {"date_filter": "yesterday"}
+- "recent data" -> {"date_filter": "recent"}
+- "Q1 2024 transactions" -> {"date_filter": "Q1 2024"}
+- "holiday season data" -> {"date_filter": "holiday season"}
+- LLM will intelligently parse all date expressions
+
+ERROR HANDLING:
+- Greetings, policy questions, off-topic -> Return None
+- Destructive operations (drop table, delete database) -> Return None
+- Vague requests without context -> CLARIFY_[TYPE]_NEEDED
+
+EXAMPLES: The user/assistant exchanges before the request show the expected reply format ("show data" there has no context).
+
+CRITICAL: Respond with ONLY one of these formats:
+MCP_TOOL: [tool_name] [table_name] [filters_json]
+CLARIFY_TABLE_NEEDED
+CLARIFY_FILTERS_NEEDED
+CLARIFY_REQUEST_NEEDED
+None
+
+NO analysis, explanations, or additional text.
+"""
+
+
+# Per-turn part of the parse prompt, filled with str.format
+_REQUEST_PROMPT_TEMPLATE = 'User Request: "{user_message}"{context_section}'
+_CONTEXT_SECTION_TEMPLATE = """
+
+Recent Conversation Context:
+{conversation_context}
+
+Previous Table: {last_table}
+Previous Filters: {last_filters}
+Previous Operation: {last_operation}
+Has Job Context: {has_job_context}
+
+This helps understand references like "show me more", "archive those records", "delete them", etc."""
+
+# Routing examples, sent as user/assistant exchanges between the system prompt and the request
+# so the whole prefix is identical on every call; user turns use the real request framing
+_ROUTING_EXAMPLES: Tuple[Tuple[str, str], ...] = (
+    # Response format
+    ('count activities', 'MCP_TOOL: get_table_stats dsiactivities {}'),
+    ('activities older than 10 days', 'MCP_TOOL: get_table_stats dsiactivities {"date_filter": "older than 10 days"}'),
+    ('count transactions older than 3 months', 'MCP_TOOL: get_table_stats dsitransactionlog {"date_filter": "older than 3 months"}'),
+    ('count of archived activities', 'MCP_TOOL: get_table_stats dsiactivitiesarchive {}'),
+    ('table statistics', 'MCP_TOOL: get_table_stats {}'),
+    # Non-date filters use execute_sql_query
+    ('count all errors occured in transactions in sept', 'MCP_TOOL: execute_sql_query {"user_prompt": "count all errors occured in transactions in sept"}'),
+    ('show failed activities', 'MCP_TOOL: execute_sql_query {"user_prompt": "show failed activities"}'),
+    ('count successful transactions', 'MCP_TOOL: execute_sql_query {"user_prompt": "count successful transactions"}'),
+    ('list all warnings', 'MCP_TOOL: execute_sql_query {"user_prompt": "list all warnings"}'),
+    ('count activities where ActivityType is Event', 'MCP_TOOL: execute_sql_query {"user_prompt": "count activities where ActivityType is Event"}'),
+    ('list activities by server', 'MCP_TOOL: execute_sql_query {"user_prompt": "list activities by server"}'),
+    ('count transactions with error', 'MCP_TOOL: execute_sql_query {"user_prompt": "count transactions with error"}'),
+    ('activities where ServerName contains prod', 'MCP_TOOL: execute_sql_query {"user_prompt": "activities where ServerName contains prod"}'),
+    ('count activities older than 10 days where ActivityType is Event', 'MCP_TOOL: execute_sql_query {"user_prompt": "count activities older than 10 days where ActivityType is Event"}'),
+    # Other operations
+    ('archive activities older than 7 days', 'MCP_TOOL: archive_records dsiactivities {"date_filter": "older than 7 days"}'),
+    ('delete archived transactions older than 30 days', 'MCP_TOOL: delete_archived_records dsitransactionlog {"date_filter": "older than 30 days"}'),
+    ('show jobs', 'MCP_TOOL: execute_sql_query {"user_prompt": "show jobs"}'),
+    ('recent jobs', 'MCP_TOOL: execute_sql_query {"user_prompt": "recent jobs"}'),
+    ('failed jobs', 'MCP_TOOL: execute_sql_query {"user_prompt": "failed jobs"}'),
+    ('job statistics', 'MCP_TOOL: execute_sql_query {"user_prompt": "job statistics"}'),
+    ('analyse the reason for recent job fail', 'MCP_TOOL: execute_sql_query {"user_prompt": "analyse the reason for recent job fail"}'),
+    ('why did jobs fail', 'MCP_TOOL: execute_sql_query {"user_prompt": "why did jobs fail"}'),
+    ('activities by server', 'MCP_TOOL: execute_sql_query {"user_prompt": "activities by server"}'),
+    ('show activities where ActivityType is Event', 'MCP_TOOL: execute_sql_query {"user_prompt": "show activities where ActivityType is Event"}'),
+    ('region status', 'MCP_TOOL: region_status {}'),
+    ('hello', 'None'),
+    ('show data', 'CLARIFY_TABLE_NEEDED'),
+)
+# Shared by every routing request and must never be mutated
+_ROUTING_FEWSHOT_MESSAGES: Final[Tuple[Dict[str, str], ...]] = tuple(
+    message
+    for user_message, reply in _ROUTING_EXAMPLES
+    for message in (
+        {"role": "user", "content": _REQUEST_PROMPT_TEMPLATE.format(user_message=user_message, context_section="")},
+        {"role": "assistant", "content": reply},
+    )
+)
+
+
+# General chat system prompt. It holds nothing per-call, so it is byte-identical on every
+# request and sent first, letting the provider reuse its cached prefix across turns
+_SYSTEM_PROMPT = """You are an AI agent for Cloud Inventory Log Management System.
+
+            - CAPABILITIES:
+            • Query database tables (dsiactivities, dsitransactionlog, and their _archive versions)
+            • Guide archiving and data management operations
+            • Check region connection status and current region information
+            • Explain safety rules and validate user requests
+
+            - CRITICAL SAFETY RULES:
+            • Archive: Records must be >7 days old
+            • Delete: Only archived records >30 days old
+            • Operations require date filters and confirmation
+            • All operations are logged and role-restricted
+
+            - DATE FORMAT: YYYYMMDDHHMMSS (e.g., 20240315123000)
+
+            - HANDLING DIFFERENT TYPES OF USER INPUTS:
+
+            1. GREETINGS & CASUAL CONVERSATION:
+            • For "hello", "hi", "how are you", etc. - Respond warmly and introduce your capabilities
+            • Example: "Hello! I'm your Cloud Inventory Log Management agent. I can help you view database statistics, guide archiving operations, and explain safety procedures."
+
+            2. GENERAL QUESTIONS ABOUT THE SYSTEM:
+            • For questions about policies, procedures, or how things work - Provide informative explanations
+            • Example: "What is archiving?" -> Explain the archiving process, safety rules, and benefits
+            • Example: "What can you do?" -> List your capabilities with examples
+
+            3. OUT-OF-CONTEXT REQUESTS:
+            • For requests completely unrelated to log management (weather, cooking, etc.) - Politely redirect to your domain
+            • Example: "I'm specialized in Cloud Inventory Log Management. I can help you with database operations, archiving procedures, and system statistics. What would you like to know about your log data?"
+
+            4. DESTRUCTIVE/DANGEROUS REQUESTS:
+            • For destructive operations outside your mandate (delete database, drop table, truncate, etc.) - Firmly decline with security explanation
+            • Example: "Delete Database" -> "I cannot and will not perform destructive database operations like deleting entire databases or dropping tables. I'm designed with safety-first principles and only support controlled archiving operations with built-in safeguards. I can help you with safe data management within established policies."
+            • Example: "Drop table" -> "I don't have permissions to drop tables or perform destructive schema operations. My role is limited to safe data viewing and controlled archiving with multiple safety checks. Would you like to see table statistics or learn about our archiving procedures instead?"
+            • Emphasize safety controls and redirect to approved operations
+
+            5. VAGUE DATABASE REQUESTS:
+            • For unclear data requests like "show data", "check something" - Ask specific clarifying questions
+            • Provide examples of what you can do rather than generic error messages
+            • Example: "I'd be happy to help! Could you specify what data you'd like to see? For example: 'Show activities statistics' or 'Count transactions older than 30 days'"
+
+            6. TECHNICAL QUESTIONS:
+            • For questions about database structure, table relationships, etc. - Provide detailed technical explanations
+            • Include table names, purposes, and relationships
+
+            7. SPECIFIC DATABASE OPERATIONS:
+            • For clear requests about tables, archiving, statistics - Process normally and provide structured responses
+            • Available tables: dsiactivities, dsitransactionlog, dsiactivitiesarchive, dsitransactionlogarchive
+
+            8. ERROR HANDLING GUIDELINES:
+            • Don't always default to the same clarification message
+            • Tailor your response to the type of confusion or vagueness
+            • If table names are unclear -> Ask specifically about which table
+            • If date criteria are vague -> Ask specifically about time ranges
+            • If the entire request is unclear -> Ask about the goal they're trying to achieve
+
+            - RESPONSE TONE & STYLE:
+            • Be helpful, professional, and domain-appropriate
+            • Use clear formatting with actionable suggestions
+            • Adapt your response style to the user's question type
+            • For casual questions -> Be conversational and welcoming
+            • For technical questions -> Be precise and detailed
+            • For vague questions -> Be guiding and educational
+            • Always prioritize data safety in operational guidance
+            • When asked about the current date, always refer to the CURRENT DATE given below
+
+            - EXAMPLES OF APPROPRIATE RESPONSES:
+            User: "Hello" -> "Hello! I'm your Cloud Inventory Log Management agent. I can help you view database statistics, check region connections, manage archiving operations, and explain safety procedures. What would you like to know about your log data?"
+            User: "What's the weather?" -> "I'm specialized in Cloud Inventory Log Management and can't help with weather information. However, I can help you with database operations, viewing statistics, archiving procedures, and system health checks. What would you like to know about your log data?"
+            User: "Delete Database" -> "I cannot and will not perform destructive database operations like deleting entire databases. I'm designed with safety-first principles and only support controlled archiving operations with built-in safeguards. My role is limited to safe data viewing and controlled archiving with multiple safety checks. Would you like to see table statistics or learn about our archiving procedures instead?"
+            User: "Drop table activities" -> "I don't have permissions to drop tables or perform destructive schema operations. Table dropping is a dangerous operation that could cause data loss and is outside my mandate. I can help you with safe operations like viewing table statistics, archiving old records, or explaining our data retention policies. What would you like to know about the activities table?"
+            User: "Show me something" -> "I'd be happy to show you information! Could you be more specific about what you'd like to see? For example:\n• 'Show activities statistics'\n• 'Count transactions from last month'\n• 'Display archive table information'\n• 'Show database health status'\n\nWhat type of data are you interested in?"
+            User: "Archive policy?" -> "Our archiving policy includes several safety measures:\n• Records must be older than 7 days before archiving\n• Only archived records older than 30 days can be deleted\n• All operations require confirmation and are logged\n• Archive operations move data to dedicated archive tables (dsiactivitiesarchive, dsitransactionlogarchive)\n\nWould you like to see statistics for any specific table or learn about performing an archive operation?"
+            User: "Which region is connected?" -> [Use region_status tool to show current region connections, available regions, and connection status for all regions]
+            Remember: Match your response style and detail level to the user's question type and apparent technical knowledge level."""
+
+
+# Volatile part of the system context, sent as a separate message after the static prompt
+_SYSTEM_DATE_TEMPLATE = """CURRENT DATE: {current_date}
+CURRENT DATE & TIME: {current_datetime}"""
+# The static system message is shared by every request and must never be mutated
+_SYSTEM_MESSAGE: Final[Dict[str, str]] = {"role": "system", "content": _SYSTEM_PROMPT}
+
+
+def _prompt_cache_key(name: str, static_prompt: str) -> str:
+    """Stable OpenAI prompt_cache_key for a static prompt; changes whenever the prompt text does"""
+    return f"{name}-{hashlib.sha256(static_prompt.encode()).hexdigest()[:16]}"
+
+
+# Route requests sharing a static prefix to the same OpenAI prompt cache
+_OPENAI_API_URL = "https://api.openai.com/v1"
+_ROUTING_PROMPT_CACHE_KEY: Final[str] = _prompt_cache_key(
+    "log-routing", _ENHANCED_PROMPT_PREFIX + "".join(message["content"] for message in _ROUTING_FEWSHOT_MESSAGES)
+)
+_CHAT_PROMPT_CACHE_KEY: Final[str] = _prompt_cache_key("log-chat", _SYSTEM_PROMPT)
+
+
+# Exact phrasings that need no LLM round-trip, mapped to the MCP_TOOL line the LLM would return
+_FAST_ROUTES = {
+    **dict.fromkeys(("region status", "current region", "which region", "region info"), "MCP_TOOL: region_status {}"),
+    **dict.fromkeys(("health check",), "MCP_TOOL: health_check {}"),
+    **dict.fromkeys(("table statistics", "database statistics", "show table stats"), "MCP_TOOL: get_table_stats {}"),
+}
+_FAST_JOB_PHRASES = frozenset({
+    "show jobs", "list jobs", "recent jobs", "latest jobs", "failed jobs", "successful jobs",
+    "job statistics", "job summary", "job status"
+})
+# Explicit table counts are only safe to shortcut when there is no conversation to continue
+_FAST_TABLE_ROUTES = {
+    **dict.fromkeys(("count activities", "activities count", "total activities"), "MCP_TOOL: get_table_stats dsiactivities {}"),
+    **dict.fromkeys(("count transactions", "transactions count", "total transactions"), "MCP_TOOL: get_table_stats dsitransactionlog {}"),
+    **dict.fromkeys(("count of archived activities", "archived activities count"), "MCP_TOOL: get_table_stats dsiactivitiesarchive {}"),
+    **dict.fromkeys(("count of archived transactions", "archived transactions count"), "MCP_TOOL: get_table_stats dsitransactionlogarchive {}"),
+}
+# Templated date-filtered requests from the prompt's examples; like the table routes they are
+# only shortcut without conversation, and the date expression is passed through as typed
+_FAST_TABLE_NOUNS = {"activities": "dsiactivities", "transactions": "dsitransactionlog"}
+_FAST_DATE_RULES = (
+    (re.compile(r"(?:count )?(activities|transactions) (older than \d+ (?:day|month|year)s?)"), "get_table_stats"),
+    (re.compile(r"archive (activities|transactions) (older than \d+ (?:day|month|year)s?)"), "archive_records"),
+    (re.compile(r"delete archived (activities|transactions) (older than \d+ (?:day|month|year)s?)"), "delete_archived_records"),
+)
+
+
+def _fast_classify(user_msg_lower: str, has_context: bool) -> Optional[str]:
+    """Return a ready MCP_TOOL line for trivially classifiable messages, or None to ask the LLM"""
+    phrase = " ".join(user_msg_lower.split()).rstrip("?.!")
+    route = _FAST_ROUTES.get(phrase)
+    if route:
+        return route
+    if phrase in _FAST_JOB_PHRASES:
+        return f"MCP_TOOL: execute_sql_query {json.dumps({'user_prompt': phrase})}"
+    if not has_context:
+        route = _FAST_TABLE_ROUTES.get(phrase)
+        if route:
+            return route
+        for pattern, tool_name in _FAST_DATE_RULES:
+            match = pattern.fullmatch(phrase)
+            if match:
+                table_name = _FAST_TABLE_NOUNS[match.group(1)]
+                return f"MCP_TOOL: {tool_name} {table_name} {json.dumps({'date_filter': match.group(2)})}"
+    return None
+
+
+# LRU of parsed (tool, table, filters) routes keyed by normalised message and the conversation
+# the prompt carries; tool results are never cached. Eviction looks at the few least recently
+# used entries and drops the one hit least often, so hot phrasings survive bursts of one-offs.
+# Only context-free routes earn hits; conversation-bound ones are the first to go
+_PARSE_CACHE_SIZE = 512
+_PARSE_EVICTION_WINDOW = 8
+_parse_cache: "OrderedDict[Tuple[Any, ...], Tuple[str, str, Dict[str, Any]]]" = OrderedDict()
+_parse_hits: Dict[Tuple[Any, ...], int] = {}
+
+
+def _parse_signature(user_message: str, conversation_context: Optional[str], has_context: bool) -> Tuple[Any, ...]:
+    """Build the cache key for a routing decision.
+
+    The routing prompt carries the full conversation text, so follow-ups such as "archive them"
+    are keyed by a digest of that text; the parsed ContextInfo fields alone are too coarse.
+    """
+    context_digest = hashlib.blake2b(conversation_context.encode(), digest_size=16).digest() if has_context else None
+    return " ".join(user_message.lower().split()), context_digest
+
+
+def _get_cached_parse(signature: Tuple[Any, ...]) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """Return a cached route, marking it recently used and counting hits on context-free routes"""
+    route = _parse_cache.get(signature)
+    if route is not None:
+        _parse_cache.move_to_end(signature)
+        if signature[1] is None:
+            _parse_hits[signature] += 1
+    return route
+
+
+def _store_cached_parse(signature: Tuple[Any, ...], route: Tuple[str, str, Dict[str, Any]]) -> None:
+    """Cache a parsed route, evicting a rarely hit entry among the least recently used when full"""
+    _parse_cache[signature] = route
+    _parse_cache.move_to_end(signature)
+    _parse_hits.setdefault(signature, 0)
+    if len(_parse_cache) > _PARSE_CACHE_SIZE:
+        candidates = islice(_parse_cache, _PARSE_EVICTION_WINDOW)
+        victim = min(candidates, key=_parse_hits.__getitem__)
+        del _parse_cache[victim]
+        del _parse_hits[victim]
+
+
+# LRU of chat answers for turns without conversation history, keyed by day and by the message
+# with only its spacing folded, so recurring greetings and FAQs skip the LLM. Case and quoted
+# literals are kept: internal prompts (SQL generation) differ in exactly those
+_RESPONSE_CACHE_SIZE = 1000
+_response_cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+# Questions whose answer depends on the clock, which the day-scoped cache key cannot capture
+_CLOCK_QUESTION_RE = re.compile(r"\b(?:time|date|today|tonight|now|clock|day|hour|minute)\b", re.IGNORECASE)
+
+
+def _response_signature(user_message: str, current_date: str) -> Tuple[str, str]:
+    """Build the cache key for a context-free chat answer"""
+    return current_date, " ".join(user_message.split())
+
+
+# Prompt tokens allowed for replayed conversation history; counted with a ~4 characters per
+# token estimate plus per-message framing, which is close enough for English chat text
+_HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "2048"))
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _estimate_tokens(text: str) -> int:
+    """Estimate the prompt tokens a message content costs"""
+    return len(text) // 4 + _MESSAGE_OVERHEAD_TOKENS
+
+
+def _trim_to_budget(messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """Keep the newest messages that fit in max_tokens, dropping the oldest first"""
+    used = 0
+    start = len(messages)
+    while start > 0:
+        used += _estimate_tokens(messages[start - 1]["content"])
+        if used > max_tokens:
+            break
+        start -= 1
+    return messages[start:]
+
+
+def _get_cached_response(signature: Tuple[str, str]) -> Optional[str]:
+    """Return a cached answer and mark it recently used"""
+    response_text = _response_cache.get(signature)
+    if response_text is not None:
+        _response_cache.move_to_end(signature)
+    return response_text
+
+
+def _store_cached_response(signature: Tuple[str, str], response_text: str) -> None:
+    """Cache an answer, evicting the least recently used entry when full"""
+    _response_cache[signature] = response_text
+    _response_cache.move_to_end(signature)
+    if len(_response_cache) > _RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+# How each MCP tool signature is called with a parsed (table, filters) route
+_MCP_CALL_ADAPTERS: Dict[str, Callable[[Callable[..., Awaitable[Any]], str, Dict[str, Any]], Awaitable[Any]]] = {
+    "table+filters+user": lambda tool, table, filters: tool(table, filters, "system"),
+    "table+filters": lambda tool, table, filters: tool(table, filters),
+    "filters": lambda tool, table, filters: tool(filters),
+    "prompt+filters": lambda tool, table, filters: tool(filters.get("user_prompt", ""), filters),
+    "none": lambda tool, table, filters: tool(),
+}
+# Signatures that cannot run without a table name
+_TABLE_REQUIRED_SIGNATURES = frozenset({"table+filters+user"})
+
+
+@lru_cache(maxsize=1)
+def _mcp_tool_dispatch() -> Mapping[str, Tuple[Callable[..., Awaitable[Any]], str]]:
+    """Map MCP tool names to (coroutine, signature), importing cloud_mcp.server once.
+    
+    The import is deferred because cloud_mcp.server imports services, which imports this module.
+    """
+    from cloud_mcp import server
+    return MappingProxyType({
+        "archive_records": (server.archive_records, "table+filters+user"),
+        "delete_archived_records": (server.delete_archived_records, "table+filters+user"),
+        "get_table_stats": (server.get_table_stats, "table+filters"),
+        "health_check": (server.health_check, "none"),
+        "region_status": (server.region_status, "none"),
+        "query_job_logs": (server._query_job_logs, "filters"),
+        "get_job_summary_stats": (server._get_job_summary_stats, "filters"),
+        "execute_sql_query": (server._execute_sql_query, "prompt+filters"),
+    })
+
+
+def _mcp_tool(tool_name: str) -> Callable[..., Awaitable[Any]]:
+    """Return the cloud_mcp.server coroutine registered for tool_name"""
+    return _mcp_tool_dispatch()[tool_name][0]
+
+
+# Shared async HTTP client; OpenAIService is created per request, so the pooled
+# connection lives at module level and is reused by every instance
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP/2 client, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60, connect=5),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30)
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client; called from the application shutdown hook"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+# Cap on in-flight OpenAI calls per process, and retries for rate-limited or 5xx replies
+_OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))
+_OPENAI_MAX_RETRIES = 3
+_openai_semaphore = asyncio.Semaphore(_OPENAI_MAX_CONCURRENCY)
+# Identical request bodies already on the wire; concurrent duplicates await the same call
+_inflight_completions: Dict[bytes, "asyncio.Task[Any]"] = {}
+
+
+async def _coalesced(key: bytes, make_call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run make_call once per key, letting concurrent callers with the same key share its result"""
+    task = _inflight_completions.get(key)
+    if task is None:
+        task = asyncio.ensure_future(make_call())
+        _inflight_completions[key] = task
+        task.add_done_callback(lambda _task: _inflight_completions.pop(key, None))
+    else:
+        logger.info("Joining in-flight OpenAI request with identical payload")
+    # Shield so one cancelled caller does not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+# Routing calls are idempotent (temperature 0), so a slow one is raced against a second
+# copy after roughly the p95 latency, and the whole race is capped by a hard deadline.
+# A copy sleeping on a 429/5xx backoff is slow because OpenAI asked it to wait, so it is
+# not hedged, and the hedge itself never retries into a rate-limited endpoint
+_HEDGE_AFTER_SECONDS = float(os.getenv("OPENAI_HEDGE_AFTER_SECONDS", "1.5"))
+_HEDGE_DEADLINE_SECONDS = float(os.getenv("OPENAI_HEDGE_DEADLINE_SECONDS", "15"))
+
+
+async def _hedged(make_call: Callable[[int, asyncio.Event], Awaitable[Any]], hedge_after: float, deadline: float) -> Any:
+    """Return the first successful result of make_call, starting a second copy if the first is slow.
+
+    make_call(retries, backing_off) runs one copy; it may retry 429/5xx replies up to retries times
+    and sets backing_off while it waits between attempts.
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline
+    backing_off = asyncio.Event()
+    tasks = {asyncio.ensure_future(make_call(_OPENAI_MAX_RETRIES, backing_off))}
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=min(hedge_after, deadline))
+        if not done and not backing_off.is_set() and loop.time() < give_up_at:
+            logger.info(f"OpenAI call still running after {hedge_after:.1f}s, sending a hedged request")
+            tasks.add(asyncio.ensure_future(make_call(0, asyncio.Event())))
+            pending = set(tasks)
+        error: Optional[BaseException] = None
+        while done or pending:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                break
+            remaining = give_up_at - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        raise error
+    finally:
+        # Cancel the loser, or every copy when the deadline or the caller gave up
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# General database statistics per region, reused for a few seconds so a burst of "table
+# statistics" questions shares one set of COUNT queries; the per-region lock makes concurrent
+# callers wait for the query already running instead of opening their own sessions
+_DB_STATS_TTL_SECONDS = 5.0
+_db_stats_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_db_stats_locks: Dict[str, asyncio.Lock] = {}
+# Bumped by every invalidation so a query that was already running cannot store pre-operation counts
+_db_stats_generation = 0
+
+
+async def _detailed_table_stats(region: str) -> Dict[str, Any]:
+    """Return general table statistics for a region, querying at most once per TTL window"""
+    lock = _db_stats_locks.get(region)
+    if lock is None:
+        lock = _db_stats_locks[region] = asyncio.Lock()
+    async with lock:
+        cached = _db_stats_cache.get(region)
+        if cached is not None and time.monotonic() < cached[0]:
+            return copy.deepcopy(cached[1])
+        generation = _db_stats_generation
+        with get_region_service().session_scope(region) as region_db_session:
+            stats = await DatabaseService(region_db_session).get_detailed_table_stats()
+        # Failures are not cached so the next request retries
+        if stats.get("success") and generation == _db_stats_generation:
+            _db_stats_cache[region] = (time.monotonic() + _DB_STATS_TTL_SECONDS, stats)
+        return copy.deepcopy(stats)
+
+
+def invalidate_table_stats_cache() -> None:
+    """Drop cached table statistics; called after confirmed archive and delete operations"""
+    global _db_stats_generation
+    _db_stats_generation += 1
+    _db_stats_cache.clear()
+
+
+class _CircuitOpenError(RuntimeError):
+    """Raised instead of calling OpenAI while the circuit breaker is open"""
+
+
+class _CircuitBreaker:
+    """Fail fast after repeated upstream failures instead of letting every request wait out its timeout.
+
+    Closed, it counts consecutive upstream failures and opens after fail_max of them. Open, it
+    rejects calls for reset_timeout seconds and then turns half-open, letting a single trial call
+    through: any response from upstream closes the breaker, an upstream failure re-opens it.
+    A trial that ends without an outcome (the caller gave up) frees the slot for the next call.
+    Each guarded block is one logical call, however many hedged copies it sends.
+    Counts are per process, like the HTTP client and semaphore.
+    """
+
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        """"closed", "open", or "half_open" once a trial call may run or is running"""
+        if self.opened_at is None:
+            return "closed"
+        if self.trial_running or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Run one logical OpenAI call, or raise _CircuitOpenError while the breaker is open"""
+        trial = self._admit()
+        try:
+            yield
+        except GeneratorExit:
+            # A consumer closing a stream early still got a healthy response
+            self._record(None, trial)
+            raise
+        except BaseException as exc:
+            self._record(exc, trial)
+            raise
+        else:
+            self._record(None, trial)
+
+    def _admit(self) -> bool:
+        """Let a call through, returning whether it is the half-open trial"""
+        if self.opened_at is None:
+            return False
+        if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+            self.rejected += 1
+            raise _CircuitOpenError("OpenAI is unavailable, circuit breaker open")
+        self.trial_running = True
+        return True
+
+    def _record(self, exc: Optional[BaseException], trial: bool) -> None:
+        """Update the state from how a call ended; exc is None for a healthy response"""
+        if trial:
+            self.trial_running = False
+        if isinstance(exc, Exception) and _is_upstream_failure(exc):
+            self.failures += 1
+            if trial or self.failures >= self.fail_max:
+                if self.opened_at is None:
+                    logger.warning(f"OpenAI circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+        elif exc is None or _is_upstream_response(exc):
+            if self.opened_at is not None:
+                logger.info(f"OpenAI circuit breaker closed after rejecting {self.rejected} calls")
+            self.failures = 0
+            self.opened_at = None
+            self.rejected = 0
+
+
+def _is_upstream_failure(error: Exception) -> bool:
+    """Transport errors, timeouts, 429 and 5xx count against the breaker; other 4xx are request bugs"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (httpx.HTTPError, asyncio.TimeoutError))
+
+
+def _is_upstream_response(error: BaseException) -> bool:
+    """A 4xx or an unparseable body still shows that OpenAI answered"""
+    return isinstance(error, (httpx.HTTPStatusError, orjson.JSONDecodeError))
+
+
+_openai_breaker = _CircuitBreaker(
+    fail_max=int(os.getenv("OPENAI_BREAKER_FAIL_MAX", "5")),
+    reset_timeout=float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+)
+
+
+async def _guarded(make_call: Callable[[], Awaitable[Any]]) -> Any:
+    """Run make_call as one logical OpenAI call through the circuit breaker"""
+    with _openai_breaker.guard():
+        return await make_call()
+
+
+def _retry_wait(response: httpx.Response, delay: float) -> float:
+    """Seconds to wait before retrying: Retry-After when OpenAI sends it, otherwise the backoff delay"""
+    try:
+        return float(response.headers.get("retry-after", delay))
+    except ValueError:
+        return delay
+
+
+_CLARIFY_TOKEN_RE = re.compile(r"CLARIFY_(?:TABLE|FILTERS|REQUEST)_NEEDED")
+# Filter JSON spellings that need no parse
+_EMPTY_FILTER_STRINGS = frozenset({"", "{}", "{ }"})
+# Replies meaning the LLM chose conversational handling on purpose
+_EMPTY_ROUTE_REPLIES = frozenset({'none', 'null', ''})
+
+
+def _needs_escalation(text: str) -> bool:
+    """True when a routing reply asks for clarification or is neither a route nor a deliberate None"""
+    if "MCP_TOOL:" in text:
+        return False
+    return _CLARIFY_TOKEN_RE.search(text) is not None or text.strip().lower() not in _EMPTY_ROUTE_REPLIES
+
+
+def _is_parse_reply_complete(text: str) -> bool:
+    """True once a routing reply holds a full decision: a CLARIFY token, a bare None or an MCP_TOOL line"""
+    # Self-delimiting replies need no trailing newline
+    if _CLARIFY_TOKEN_RE.search(text) or text.strip() == "None":
+        return True
+    index = text.find("MCP_TOOL:")
+    if index == -1:
+        return False
+    if text.find("\n", index) != -1:
+        return True
+    # The filters object ends the line, so a tail that parses as JSON is a full decision;
+    # this saves waiting for the stop sequence and the [DONE] event
+    tail = text.rstrip()
+    if not tail.endswith("}"):
+        return False
+    try:
+        orjson.loads(tail[tail.find("{", index):])
+    except orjson.JSONDecodeError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=2)
+def _formatted_now(epoch_second: int) -> Tuple[str, str]:
+    """Return (date, datetime) strings for the given second, formatted once per second"""
+    now = datetime.fromtimestamp(epoch_second)
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@lru_cache(maxsize=2)
+def _system_date_message(epoch_second: int) -> Dict[str, str]:
+    """Return the date system message for the given second; shared, so callers must not mutate it"""
+    current_date, current_datetime = _formatted_now(epoch_second)
+    return {
+        "role": "system",
+        "content": _SYSTEM_DATE_TEMPLATE.format(current_date=current_date, current_datetime=current_datetime)
+    }
+
+
+# Fallback response texts per intent; {error_msg} is the only per-call part
+_FALLBACK_TEMPLATES: Mapping[str, str] = MappingProxyType({
+    "greeting": (
+        "Hello! I'm your Cloud Inventory Log Management agent{error_msg}. "
+        "I'm here to help you manage your database operations safely and efficiently.\n\n"
+        "What I can help with:\n"
+        "• View database statistics and record counts\n"
+        "• Guide archiving and data management operations\n"
+        "• Explain safety policies and procedures\n"
+        "• Monitor system health and performance\n\n"
+        "What would you like to know about your log data?"
+    ),
+    "help": (
+        "I'm having trouble with my full response system right now{error_msg}, but I can still help! "
+        "I'm specialized in Cloud Inventory Log Management with these capabilities:\n\n"
+        "Data Operations:\n"
+        "• View table statistics and record counts\n"
+        "• Query specific data ranges and filters\n\n"
+        "Archive Management:\n"
+        "• Guide safe archiving procedures (7+ day old records)\n"
+        "• Manage archive table operations\n\n"
+        "Safety & Compliance:\n"
+        "• Enforce data retention policies\n"
+        "• Provide operation confirmations and logging\n\n"
+        "Try asking me about specific tables or operations!"
+    ),
+    "database": (
+        "I'm experiencing some technical difficulties{error_msg}, but I can still assist with your database request! "
+        "Could you be more specific about what you'd like to see?\n\n"
+        "Available Tables:\n\n"
+        "• dsiactivities - Current activity logs\n"
+        "• dsitransactionlog - Current transaction logs\n"
+        "• dsiactivitiesarchive - Archived activity logs\n"
+        "• dsitransactionlogarchive - Archived transaction logs\n\n"
+    ),
+    "off_topic": (
+        "I'm having some technical issues right now{error_msg}. "
+        "I'm specialized in Cloud Inventory Log Management and can't help with topics outside that domain. "
+        "However, I'd be happy to help you with:\n\n"
+        "My Specialties:\n"
+        "• Database operations and statistics\n"
+        "• Log data archiving and management\n"
+        "• System safety and compliance procedures\n"
+        "• Data retention policy guidance\n\n"
+        "What would you like to know about your log management system?"
+    ),
+    "default": (
+        "I'm experiencing some technical difficulties processing your request{error_msg}. "
+        "I'm your Cloud Inventory Log Management agent and I'm here to help with database operations.\n\n"
+        "How I can help:\n"
+        "• View table statistics and record counts\n"
+        "• Guide you through archiving procedures\n"
+        "• Explain safety rules and best practices\n"
+        "• Monitor system health and performance\n\n"
+        "Could you try rephrasing your request"
+    ),
+})
+_FALLBACK_SUGGESTIONS: Final[Tuple[str, ...]] = ("Show table statistics",)
+
+
+@lru_cache(maxsize=16)
+def _build_fallback_response(intent: str, error: Optional[str] = None) -> Mapping[str, Any]:
+    """Build the fallback response for an intent once; cached copies are shared read-only views"""
+    error_msg = f" (Technical issue: {error})" if error else ""
+    template = _FALLBACK_TEMPLATES.get(intent, _FALLBACK_TEMPLATES["default"])
+    
+    return MappingProxyType({
+        "response": template.replace("{error_msg}", error_msg),
+        "suggestions": _FALLBACK_SUGGESTIONS,
+        "source": "fallback"
+    })
+
+
+@dataclass(frozen=True, slots=True)
+class ContextInfo:
+    """Table, filter and job context parsed from a conversation history; immutable so it can be shared"""
+    last_table: Optional[str] = None
+    last_filters: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+    last_operation: Optional[str] = None
+    last_job_operation: Optional[str] = None
+    last_job_filters: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+    has_job_context: bool = False
+
+
+# Shared context for turns without conversation history
+_EMPTY_CONTEXT_INFO: Final[ContextInfo] = ContextInfo()
+
+
+@lru_cache(maxsize=256)
+def _parse_context_info(conversation_context: Optional[str]) -> ContextInfo:
+    """Parse table, filter and job context from a conversation history string.
+    
+    The history is resent on every turn of a chat, so results are cached by the
+    context string; the returned ContextInfo is immutable and shared between callers.
+    """
+    context_info = {
+        "last_table": None,
+        "last_filters": {},
+        "last_operation": None,
+        "last_job_operation": None,
+        "last_job_filters": {},
+        "has_job_context": False
+    }
+    
+    if not conversation_context:
+        return _EMPTY_CONTEXT_INFO
+        
+    try:
+        context_lower = conversation_context.lower()
+        
+        # Single scan; the last match is the most recently mentioned table
+        for match in _CONTEXT_TABLE_RE.finditer(context_lower):
+            context_info["last_table"] = match.group(0)
+        
+        # Extract common filter patterns from context
+        if "older than" in context_lower:
+            # Look for "older than X days/months/years"; like the table, the last mention is the current one
+            match = None
+            for match in _OLDER_THAN_RE.finditer(context_lower):
+                pass
+            if match:
+                number, unit = match.groups()
+                context_info["last_filters"] = {"date_filter": f"older_than_{number}_{unit}s"}
+        
+        if "archive" in context_lower:
+            context_info["last_operation"] = "archive"
+        elif "count" in context_lower or "statistics" in context_lower:
+            context_info["last_operation"] = "stats"
+        elif "delete" in context_lower:
+            context_info["last_operation"] = "delete"
+        
+        # Extract job log context
+        if "[job context:" in context_lower or "job logs" in context_lower or "job query" in context_lower:
+            context_info["has_job_context"] = True
+            context_info["last_job_operation"] = "job_logs"
+            
+            # Extract job-specific filters from context
+            # Extract job types
+            job_type_match = _JOB_TYPE_RE.search(context_lower)
+            if job_type_match:
+                context_info["last_job_filters"]["job_type"] = job_type_match.group(1).strip()
+            
+            # Extract status filters (more specific patterns)
+            status_match = _STATUS_RE.search(context_lower)
+            if status_match:
+                status_value = status_match.group(1).strip()
+                context_info["last_job_filters"]["status"] = status_value
+                if status_value.upper() == "FAILED":
+                    context_info["last_job_filters"]["failed_only"] = True
+                elif status_value.upper() == "SUCCESS":
+                    context_info["last_job_filters"]["successful_only"] = True
+            
+            # Extract table filters
+            tables_match = _TABLES_RE.search(context_lower)
+            if tables_match:
+                context_info["last_job_filters"]["table_name"] = tables_match.group(1).strip()
+            
+            # Extract date range filters
+            date_match = _DATE_RANGE_RE.search(context_lower)
+            if date_match:
+                context_info["last_job_filters"]["date_range"] = date_match.group(1).strip()
+            
+            # Handle direct job_types/job_type patterns
+            job_types_match = _JOB_TYPES_RE.search(context_lower)
+            if job_types_match:
+                context_info["last_job_filters"]["job_type"] = job_types_match.group(1).strip()
+            
+            # Don't assume failed status unless explicitly mentioned
+            # Remove the automatic failed/successful detection that was causing issues
+                        
+    except Exception as e:
+        logger.warning(f"Error extracting context info: {e}")
+        
+    return ContextInfo(
+        last_table=context_info["last_table"],
+        last_filters=MappingProxyType(context_info["last_filters"]),
+        last_operation=context_info["last_operation"],
+        last_job_operation=context_info["last_job_operation"],
+        last_job_filters=MappingProxyType(context_info["last_job_filters"]),
+        has_job_context=context_info["has_job_context"]
+    )
+
+
+# Clarification replies for MCP_TOOL lines that cannot be executed
+_INVALID_TOOL_MESSAGE: Final[str] = (
+    "I encountered an invalid operation '{tool_name}'. "
+    "I can help you with the following operations:\n\n"
+    "Available Operations:\n"
+    "• Count/Statistics: \"Count activities\", \"Activities older than 10 days\", \"Table statistics\"\n"
+    "• Archive Data: \"Archive activities older than 7 days\", \"Archive old transactions\"\n"
+    "• Delete Data: \"Delete archived activities older than 30 days\" (permanent removal)\n"
+    "• System Info: \"Health check\", \"Region status\", \"Database status\"\n"
+    "• Custom Queries: Complex WHERE conditions, analysis queries\n\n"
+)
+_INVALID_TABLE_MESSAGE: Final[str] = (
+    "Please specify one of the following valid tables:\n\n"
+    "Available Tables:\n\n"
+    "• dsiactivities - Current activity logs\n"
+    "• dsitransactionlog - Current transaction logs\n"
+    "• dsiactivitiesarchive - Archived activity logs\n"
+    "• dsitransactionlogarchive - Archived transaction logs\n\n"
+)
+_INVALID_FILTERS_MESSAGE: Final[str] = (
+    "I had trouble understanding the filter criteria. "
+    "Please provide clearer date or filter information:\n\n"
+    "Date Filter Examples:\n"
+    "• \"records older than 10 months\"\n"
+    "• \"data from last year\"\n"
+    "• \"recent activities\"\n\n"
+)
+
+# Clarification replies for the CLARIFY_*_NEEDED tokens the routing LLM can return
+_CLARIFY_TABLE_MESSAGE: Final[str] = (
+    "I need clarification about which table you'd like to work with. "
+    "Please specify one of the following:\n\n"
+    "Available Tables:\n"
+    "• dsiactivities - Current activity logs\n"
+    "• dsitransactionlog - Current transaction logs\n"
+    "• dsiactivitiesarchive - Archived activity logs\n"
+    "• dsitransactionlogarchive - Archived transaction logs\n\n"
+)
+_CLARIFY_FILTERS_MESSAGE: Final[str] = (
+    "I need more specific information about the date or filter criteria. "
+    "Please provide more details:\n\n"
+    "Date Filter Examples:\n"
+    "• \"records older than 10 months\"\n"
+    "• \"data from last year\"\n"
+    "• \"recent activities\"\n"
+)
+_CLARIFY_REQUEST_MESSAGE: Final[str] = (
+    "I'm not sure what you'd like me to do. Could you please clarify your request?\n\n"
+    "I can help you with:\n\n"
+    "• View Data: \"Show table statistics\" or \"Count activities\"\n"
+    "• Archive Data: \"Archive old records\" or \"Archive activities older than 7 days\"\n"
+    "• Delete Data: \"Delete archived records\" (with proper date filters)\n"
+    "• System Info: \"Health check\" or \"Database status\"\n\n"
+)
+_CLARIFICATION_MESSAGES: Mapping[str, str] = MappingProxyType({
+    "CLARIFY_TABLE_NEEDED": _CLARIFY_TABLE_MESSAGE,
+    "CLARIFY_FILTERS_NEEDED": _CLARIFY_FILTERS_MESSAGE,
+    "CLARIFY_REQUEST_NEEDED": _CLARIFY_REQUEST_MESSAGE,
+})
+
+
+@dataclass(slots=True)
+class EnhancedLLMResult:
+    """Outcome of routing a message to an MCP tool"""
+    tool_used: str
+    table_used: str
+    filters: Dict[str, Any]
+    mcp_result: Any
+    context_preserved: bool = False
+    is_database_operation: bool = True
+    operation: Any = None  # Will be handled by MCP result
+    # Store for future context reference
+    context_info: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if not self.context_info:
+            self.context_info = {"table": self.table_used, "filters": self.filters, "operation": self.tool_used}
+
+
+@dataclass(slots=True)
+class ClarificationResult:
+    """Reply asking the user to clarify instead of running an operation"""
+    clarification_message: str
+    is_clarification_request: bool = True
+    is_database_operation: bool = False
+    tool_used: Optional[str] = None
+    table_used: Optional[str] = None
+    # Don't set mcp_result for clarification requests to avoid confusion
+    mcp_result: Any = None
+
+
 class OpenAIService:
     """Service for LLM integration using OpenAI"""
 
+    # MCP tools and tables the parse prompt may name
+    _VALID_TOOLS = frozenset({
+        "get_table_stats", "archive_records", "delete_archived_records",
+        "health_check", "region_status", "execute_sql_query"
+    })
+    # Tools whose MCP_TOOL line carries filters straight after the tool name
+    _TOOLS_WITHOUT_TABLES = frozenset({"health_check", "region_status", "execute_sql_query"})
+    _VALID_TABLES = frozenset({"dsiactivities", "dsitransactionlog", "dsiactivitiesarchive", "dsitransactionlogarchive", ""})
+    # Fixed parts of the general chat payload; factual turns are sampled greedily so identical
+    # requests get identical answers, free-form conversation keeps the previous sampling settings
+    _BASE_PAYLOAD: Mapping[str, Any] = MappingProxyType({"max_tokens": 1000, "temperature": 0.7, "top_p": 0.8})
+    _FACTUAL_PAYLOAD: Mapping[str, Any] = MappingProxyType({"max_tokens": 1000, "temperature": 0.0})
+    # Greetings and thanks get a one-paragraph reply; capability, date and off-topic questions
+    # get a short guided answer. Both are greedy so repeats read the same
+    _TRIVIAL_PAYLOAD: Mapping[str, Any] = MappingProxyType({"max_tokens": 150, "temperature": 0.0})
+    _CONVERSATIONAL_PAYLOAD: Mapping[str, Any] = MappingProxyType({"max_tokens": 300, "temperature": 0.0})
+
     def __init__(self):
         # Use OpenAI exclusively
         self.api_key = os.getenv("OPENAI_API_KEY")
         self.model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        # Routing is a one-line classification, so it runs on a small model; a larger one, when
+        # configured, gets a second try only at replies the small model could not route
+        self.parse_model = os.getenv("OPENAI_PARSE_MODEL", self.model_name)
+        self.escalation_model = os.getenv("OPENAI_MODEL_LARGE")
         self.provider = "openai"
-        self.base_url = "https://api.openai.com/v1"
+        # Any OpenAI-compatible server (e.g. a self-hosted vLLM or Ollama) can stand in for the API
+        self.base_url = os.getenv("OPENAI_BASE_URL", _OPENAI_API_URL).rstrip("/")
+        # prompt_cache_key is an OpenAI extension; compatible servers may reject unknown fields
+        self.use_prompt_cache_key = self.base_url == _OPENAI_API_URL
+        # llama.cpp servers only reuse the KV cache of the shared system prefix when asked to
+        self.use_cache_prompt = not self.use_prompt_cache_key and os.getenv("LLM_CACHE_PROMPT", "false").lower() == "true"
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -34,184 +1338,141 @@ class OpenAIService:
             logger.error(f"Failed to initialize OpenAI service: {e}")
             raise
     
-    def _extract_context_info(self, conversation_context: Optional[str] = None) -> Dict[str, Any]:
+    async def _post_chat_completion(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """POST a chat completion, sharing one upstream call between concurrent identical payloads"""
+        body = orjson.dumps(payload)
+        return await _coalesced(body, lambda: self._send_chat_completion(body, timeout))
+    
+    async def _send_chat_completion(self, body: bytes, timeout: float) -> Dict[str, Any]:
+        """POST a chat completion under the shared concurrency cap, backing off on 429/5xx"""
+        url = f"{self.base_url}/chat/completions"
+        delay = 1.0
+        with _openai_breaker.guard():
+            async with _openai_semaphore:
+                for attempt in range(_OPENAI_MAX_RETRIES + 1):
+                    response = await _get_http_client().post(url, headers=self.headers, content=body, timeout=timeout)
+                    retryable = response.status_code == 429 or response.status_code >= 500
+                    if retryable and attempt < _OPENAI_MAX_RETRIES:
+                        wait = _retry_wait(response, delay)
+                        logger.warning(f"OpenAI returned {response.status_code}, retrying in {wait:.1f}s (attempt {attempt + 1}/{_OPENAI_MAX_RETRIES})")
+                        await asyncio.sleep(wait)
+                        delay *= 2
+                        continue
+                    response.raise_for_status()
+                    return orjson.loads(response.content)
+    
+    async def _stream_chat_completion(self, payload: Dict[str, Any], timeout: float,
+                                      is_complete: Callable[[str], bool]) -> str:
+        """Stream a chat completion and stop reading as soon as is_complete(text) holds.
+
+        Deterministic (temperature 0) payloads are hedged against tail latency.
+        """
+        body = orjson.dumps({**payload, "stream": True})
+        if payload.get("temperature") != 0:
+            return await _coalesced(body, lambda: _guarded(lambda: self._read_chat_stream(body, timeout, is_complete)))
+        return await _coalesced(body, lambda: _guarded(lambda: _hedged(
+            lambda retries, backing_off: self._read_chat_stream(body, timeout, is_complete, retries, backing_off),
+            hedge_after=_HEDGE_AFTER_SECONDS,
+            deadline=_HEDGE_DEADLINE_SECONDS
+        )))
+    
+    async def _read_chat_stream(self, body: bytes, timeout: float, is_complete: Callable[[str], bool],
+                                retries: int = _OPENAI_MAX_RETRIES, backing_off: Optional[asyncio.Event] = None) -> str:
+        """Collect streamed completion text, closing the stream as soon as is_complete(text) holds"""
+        text = ""
+        async with aclosing(self._iter_chat_stream(body, timeout, retries, backing_off)) as deltas:
+            async for delta in deltas:
+                text += delta
+                # Leaving the block closes the stream, so the rest is never generated
+                if is_complete(text):
+                    break
+        return text.strip()
+    
+    async def _iter_chat_stream(self, body: bytes, timeout: float, retries: int = _OPENAI_MAX_RETRIES,
+                                backing_off: Optional[asyncio.Event] = None) -> AsyncIterator[str]:
+        """Yield server-sent completion deltas under the shared concurrency cap, backing off on 429/5xx.
+
+        backing_off, when given, is set once the call has to wait for a retry. Callers guard the
+        whole logical call with the circuit breaker, so hedged copies are not counted twice.
+        """
+        url = f"{self.base_url}/chat/completions"
+        delay = 1.0
+        async with _openai_semaphore:
+            for attempt in range(retries + 1):
+                async with _get_http_client().stream("POST", url, headers=self.headers, content=body, timeout=timeout) as response:
+                    retryable = response.status_code == 429 or response.status_code >= 500
+                    if not (retryable and attempt < retries):
+                        if response.is_error:
+                            await response.aread()
+                            response.raise_for_status()
+                        
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data: "):
+                                continue
+                            data = line[6:]
+                            if data == "[DONE]":
+                                break
+                            choices = orjson.loads(data).get("choices")
+                            if choices:
+                                content = choices[0].get("delta", {}).get("content")
+                                if content:
+                                    yield content
+                        return
+                    wait = _retry_wait(response, delay)
+                logger.warning(f"OpenAI returned {response.status_code}, retrying in {wait:.1f}s (attempt {attempt + 1}/{retries})")
+                if backing_off is not None:
+                    backing_off.set()
+                await asyncio.sleep(wait)
+                delay *= 2
+    
+    def _extract_context_info(self, conversation_context: Optional[str] = None) -> ContextInfo:
         """Extract table name, filters, and job log context from conversation context"""
-        context_info = {
-            "last_table": None,
-            "last_filters": {},
-            "last_operation": None,
-            "last_job_operation": None,
-            "last_job_filters": {},
-            "has_job_context": False
-        }
-        
-        if not conversation_context:
-            return context_info
-            
-        try:
-            context_lower = conversation_context.lower()
-            
-            table_mentions = []
-            for table in ["dsitransactionlogarchive", "dsiactivitiesarchive", "dsitransactionlog", "dsiactivities", "job_logs"]:
-                if table in context_lower:
-                    # Find the position of the last mention
-                    last_pos = context_lower.rfind(table)
-                    table_mentions.append((last_pos, table))
-            
-            # Sort by position (most recent first)
-            if table_mentions:
-                table_mentions.sort(reverse=True)
-                context_info["last_table"] = table_mentions[0][1]
-            
-            # Extract common filter patterns from context
-            if "older than" in context_lower:
-                import re
-                # Look for "older than X days/months/years"
-                pattern = r"older than (\d+) (day|month|year)s?"
-                match = re.search(pattern, context_lower)
-                if match:
-                    number, unit = match.groups()
-                    context_info["last_filters"] = {"date_filter": f"older_than_{number}_{unit}s"}
-            
-            if "archive" in context_lower:
-                context_info["last_operation"] = "archive"
-            elif "count" in context_lower or "statistics" in context_lower:
-                context_info["last_operation"] = "stats"
-            elif "delete" in context_lower:
-                context_info["last_operation"] = "delete"
-            
-            # Extract job log context
-            if "[job context:" in context_lower or "job logs" in context_lower or "job query" in context_lower:
-                context_info["has_job_context"] = True
-                context_info["last_job_operation"] = "job_logs"
-                
-                # Extract job-specific filters from context
-                import re
-                
-                # Extract job types
-                job_type_match = re.search(r"job_type: ([^,\]]+)", context_lower)
-                if job_type_match:
-                    context_info["last_job_filters"]["job_type"] = job_type_match.group(1).strip()
-                
-                # Extract status filters (more specific patterns)
-                status_match = re.search(r"status: ([^,\]]+)", context_lower)
-                if status_match:
-                    status_value = status_match.group(1).strip()
-                    context_info["last_job_filters"]["status"] = status_value
-                    if status_value.upper() == "FAILED":
-                        context_info["last_job_filters"]["failed_only"] = True
-                    elif status_value.upper() == "SUCCESS":
-                        context_info["last_job_filters"]["successful_only"] = True
-                
-                # Extract table filters
-                tables_match = re.search(r"tables: ([^,\]]+)", context_lower)
-                if tables_match:
-                    context_info["last_job_filters"]["table_name"] = tables_match.group(1).strip()
-                
-                # Extract date range filters
-                date_match = re.search(r"date_range: ([^,\]]+)", context_lower)
-                if date_match:
-                    context_info["last_job_filters"]["date_range"] = date_match.group(1).strip()
-                
-                # Handle direct job_types/job_type patterns
-                job_types_match = re.search(r"job_types: ([^,\]]+)", context_lower)
-                if job_types_match:
-                    context_info["last_job_filters"]["job_type"] = job_types_match.group(1).strip()
-                
-                # Don't assume failed status unless explicitly mentioned
-                # Remove the automatic failed/successful detection that was causing issues
-                            
-        except Exception as e:
-            logger.warning(f"Error extracting context info: {e}")
-            
-        return context_info
+        # The cached result is immutable, so it is handed out as is
+        return _parse_context_info(conversation_context or None)
 
-    def _determine_table_from_context(self, user_message: str, context_info: Dict[str, Any]) -> str:
+    def _determine_table_from_context(self, user_message: str, context_info: ContextInfo, user_msg_lower: Optional[str] = None) -> str:
         """Determine table name using message content and context"""
-        user_msg_lower = user_message.lower()
-        
-        if "dsitransactionlogarchive" in user_msg_lower:
-            return "dsitransactionlogarchive"
-        elif "dsiactivitiesarchive" in user_msg_lower:
-            return "dsiactivitiesarchive"
-        elif "dsitransactionlog" in user_msg_lower and "archive" not in user_msg_lower:
-            return "dsitransactionlog"
-        elif "dsiactivities" in user_msg_lower and "archive" not in user_msg_lower:
-            return "dsiactivities"
+        if user_msg_lower is None:
+            user_msg_lower = user_message.lower()
         
-        # Second priority: Let LLM determine context-dependent queries
-        # Simple check: if no explicit table mentioned and we have context, let LLM decide
-        has_explicit_table = ("transaction" in user_msg_lower or "activit" in user_msg_lower or 
-                             "dsitransactionlog" in user_msg_lower or "dsiactivities" in user_msg_lower)
+        # One scan for every table-related token in the message, then a table lookup
+        mask = 0
+        for token in _MSG_TOKENS_RE.findall(user_msg_lower):
+            mask |= _TABLE_TOKEN_BITS[token]
+        table = _MASK_TO_TABLE[mask]
+        if table:
+            return table
         
-        # If no explicit table mentioned and we have previous context, preserve it
+        # No explicit table mentioned: preserve the previous table from context
         # The LLM prompt will handle the intelligent decision-making
-        if not has_explicit_table and context_info.get("last_table"):
-            return context_info["last_table"]
-        
-        # Third priority: Explicit table type mentions (fresh requests with table specified)
-        # These are NEW queries that explicitly mention table type, use main tables
-        
-        if "transaction" in user_msg_lower:
-            # "transactions older than X" or "show transactions" or "yesterday's transactions" → use main table
-            if "archive" in user_msg_lower:
-                return "dsitransactionlogarchive"
-            return "dsitransactionlog"
-        elif "activit" in user_msg_lower:
-            # "activities older than X" or "show activities" → use main table  
-            if "archive" in user_msg_lower:
-                return "dsiactivitiesarchive"
-            return "dsiactivities"
-        
-        # Handle specific yesterday patterns
-        if "yesterday" in user_msg_lower:
-            if "transaction" in user_msg_lower:
-                return "dsitransactionlog"
-            elif "activit" in user_msg_lower:
-                return "dsiactivities"
-        
-
+        if context_info.last_table:
+            return context_info.last_table
         
         # Default fallback
         return "dsiactivities"
 
-    def _determine_filters_from_context(self, user_message: str, context_info: Dict[str, Any]) -> Dict[str, Any]:
+    def _determine_filters_from_context(self, user_message: str, context_info: ContextInfo, user_msg_lower: Optional[str] = None) -> Dict[str, Any]:
         """Determine filters using message content and context - Now uses LLM date parsing"""
-        user_msg_lower = user_message.lower()
+        if user_msg_lower is None:
+            user_msg_lower = user_message.lower()
         filters = {}
         
-        # Check if message contains date-related terms that should be parsed by LLM
-        date_keywords = [
-            'january', 'february', 'march', 'april', 'may', 'june',
-            'july', 'august', 'september', 'october', 'november', 'december',
-            'last', 'past', 'recent', 'older', 'newer', 'yesterday', 'today',
-            'week', 'month', 'year', 'day', 'quarter', 'season', 'holiday',
-            'ago', 'before', 'after', 'since', 'from', 'to', 'between',
-            'this', 'current', 'previous', 'fiscal', 'maintenance', 'busy'
-        ]
-        
         # If message contains date keywords, pass the raw message as date_filter
         # The LLM date filter will handle the intelligent parsing
-        has_date_terms = any(keyword in user_msg_lower for keyword in date_keywords)
+        has_date_terms = _DATE_KEYWORD_RE.search(user_msg_lower) is not None
         
         if has_date_terms:
             # For messages with date terms, let the LLM parse the entire message
             # This is more reliable than trying to extract with regex
             
-            # Check for specific month names to handle the "january" case
-            month_names = ['january', 'february', 'march', 'april', 'may', 'june',
-                          'july', 'august', 'september', 'october', 'november', 'december']
-            
-            found_month = None
-            for month in month_names:
-                if month in user_msg_lower:
-                    found_month = month
-                    break
+            # Check for specific month names to handle the "january" case;
+            # calendar order wins when several months are mentioned
+            found_months = _MONTH_RE.findall(user_msg_lower)
+            found_month = min(found_months, key=_MONTH_ORDER.__getitem__) if found_months else None
             
             if found_month:
                 # For month-specific queries, extract the month and year if present
-                import re
-                year_match = re.search(r'\b(20\d{2})\b', user_message)
+                year_match = _YEAR_RE.search(user_message)
                 if year_match:
                     filters["date_filter"] = f"{found_month} {year_match.group(1)}"
                 else:
@@ -220,7 +1481,7 @@ class OpenAIService:
                 # For other date expressions, pass the whole message to LLM
                 # Remove table-specific words to focus on date part
                 clean_message = user_message
-                for word in ['transactions', 'activities', 'records', 'data', 'logs']:
+                for word in _DATE_FILTER_NOISE_WORDS:
                     clean_message = clean_message.replace(word, '').strip()
                 
                 # Clean up extra spaces and common words
@@ -228,7 +1489,7 @@ class OpenAIService:
                 filters["date_filter"] = clean_message if clean_message else user_message
         
         # If no date terms found but context suggests continuation, check context for filters
-        elif not filters and context_info.get('has_job_context'):
+        elif not filters and context_info.has_job_context:
             # This might be a follow-up query in job logs context
             pass
         
@@ -236,265 +1497,184 @@ class OpenAIService:
 
     async def parse_with_enhanced_tools(self, user_message: str, conversation_context: Optional[str] = None) -> Optional[Any]:
         """Enhanced LLM parsing with separate table and filter context tracking"""
+        context_info = None
         try:
-            # Extract context information
-            context_info = self._extract_context_info(conversation_context)
-            
-            # Process through LLM for context-aware results
-            context_section = ""
-            if conversation_context and "Previous conversation:" in conversation_context:
-                context_section = f"""
-
-            Recent Conversation Context:
-            {conversation_context}
-
-            Previous Table: {context_info.get('last_table', 'None')}
-            Previous Filters: {context_info.get('last_filters', {})}
-            Previous Operation: {context_info.get('last_operation', 'None')}
-            Has Job Context: {context_info.get('has_job_context', False)}
-
-            This helps understand references like "show me more", "archive those records", "delete them", etc.
-            """
-            
-            enhanced_prompt = f"""
-            You are an expert database operations agent. Analyze user requests using natural language understanding and conversational context.
-
-            User Request: "{user_message}"
-            {context_section}
-
-            Available Database Tables:
-            - dsiactivities: Main activity logs (current records)
-            - dsitransactionlog: Main transaction logs (current records)  
-            - dsiactivitiesarchive: Archived activity logs (old records)
-            - dsitransactionlogarchive: Archived transaction logs (old records)
-
-            Available MCP Tools:
-            1. get_table_stats - For counting records and table statistics with date filters
-            2. archive_records - For archiving old records (7+ days old) from main tables to archive tables
-            3. delete_archived_records - For deleting old archived records (30+ days old) from archive tables
-            4. health_check - For system health/status checks
-            5. region_status - For region connection status and current region info
-            6. execute_sql_query - For custom SQL queries using natural language (includes ALL job queries and complex conditions)
-
-            CRITICAL ANALYSIS RULES:
-
-            1. STATISTICS/COUNTING QUERIES (USE get_table_stats):
-            - "count activities", "activities count", "total activities" → get_table_stats
-            - "count transactions", "transactions count", "total transactions" → get_table_stats  
-            - "activities older than X days/months" → get_table_stats with date_filter
-            - "transactions older than X days/months" → get_table_stats with date_filter
-            - "count of archived activities", "archived activities count" → get_table_stats
-            - "count of archived transactions", "archived transactions count" → get_table_stats
-            - "table statistics", "database statistics", "show table stats" → get_table_stats
-            - Simple counting queries with ONLY date filters (no other filters) → get_table_stats
-            
-            IMPORTANT: If the query has ANY filters other than date filters (like ActivityType, ServerName, specific field values, WHERE conditions), use execute_sql_query instead!
-
-            2. JOB QUERIES (USE execute_sql_query):
-            - "show jobs", "list jobs", "recent jobs", "latest jobs" → execute_sql_query
-            - "failed jobs", "successful jobs", "job status" → execute_sql_query
-            - "job statistics", "job summary", "job stats" → execute_sql_query
-            - "archive jobs", "delete jobs" (about job execution logs, not data) → execute_sql_query
-            - "jobs from last week", "jobs today", "recent job executions" → execute_sql_query
-            - ALL job-related queries should use execute_sql_query for maximum flexibility
-            - Job queries target the job_logs table via SQL generation
-            - ANALYSIS/REASONING queries about jobs → execute_sql_query (e.g., "analyse job fail", "why jobs fail", "job failure reasons")
-
-            3. ARCHIVE OPERATIONS (USE archive_records):
-            - "archive activities", "archive old activities", "archive activities older than X" → archive_records
-            - "archive transactions", "archive old transactions", "archive transactions older than X" → archive_records
-            - Must be clear operational intent for moving data to archive tables
-
-            4. DELETE OPERATIONS (USE delete_archived_records):
-            - "delete archived activities", "delete old archived activities" → delete_archived_records
-            - "delete archived transactions", "delete old archived transactions" → delete_archived_records
-            - Must be clear operational intent for permanently removing archived data
-
-            5. REGION QUERIES (USE region_status):
-            - EXACT phrases: "region status", "current region", "which region", "region info" → region_status
-            - Must be specifically about region/connection status
-
-            6. CUSTOM SQL QUERIES (USE execute_sql_query - FOR NON-DATE FILTERS & COMPLEX CONDITIONS):
-            - ANY count/list queries with non-date filters → execute_sql_query
-            - Queries with status/condition keywords: "errors", "failed", "successful", "warnings", "exceptions", "timeout" → execute_sql_query
-            - "count all errors in transactions" → execute_sql_query
-            - "show failed activities" → execute_sql_query
-            - "count successful transactions" → execute_sql_query
-            - "list all warnings" → execute_sql_query
-            - "count activities where ActivityType = 'Event'" → execute_sql_query
-            - "list activities by server" → execute_sql_query
-            - "count transactions with specific criteria" → execute_sql_query
-            - "activities where ServerName contains 'prod'" → execute_sql_query
-            - Complex WHERE conditions with multiple criteria → execute_sql_query
-            - Queries with specific field matching (e.g., ActivityType = 'Event') → execute_sql_query
-            - JOIN operations or multi-table queries → execute_sql_query
-            - ANALYSIS queries (why, analyse, reason, cause) → execute_sql_query
-            - "show activities where ActivityType is Event", "find records with...", "activities by server" → execute_sql_query
-            - "list transactions where...", "get data with specific criteria", "filter by multiple conditions" → execute_sql_query
-            - "analyse job fail", "why jobs fail", "job failure reasons" → execute_sql_query
-            - Any queries with filters beyond simple date filtering → execute_sql_query
-
-            CONTEXT HANDLING (CRITICAL):
-            - PRESERVE context from previous queries for follow-up requests
-            - "archive them", "delete them", "count them" → Use EXACT table + filters from previous query
-            - Archive context preservation: After "archived X" query, follow-ups stay on archive table
-
-            TABLE SELECTION LOGIC:
-            - NEW explicit requests: "count transactions" → dsitransactionlog (main table)
-            - CONTEXTUAL references: Use previous table from conversation
-            - Archive preservation: "archived X" context + follow-up → keep archive table
-
-            DATE FILTER PARSING (LLM-Enhanced):
-            - Use natural language date expressions directly in date_filter
-            - "transactions in month of january" → {{"date_filter": "january"}}
-            - "older than 10 months" → {{"date_filter": "older than 10 months"}}
-            - "from last year" → {{"date_filter": "last year"}}
-            - "yesterday's activities" → {{"date_filter": "yesterday"}}
-            - "recent data" → {{"date_filter": "recent"}}
-            - "Q1 2024 transactions" → {{"date_filter": "Q1 2024"}}
-            - "holiday season data" → {{"date_filter": "holiday season"}}
-            - LLM will intelligently parse all date expressions
-
-            ERROR HANDLING:
-            - Greetings, policy questions, off-topic → Return None
-            - Destructive operations (drop table, delete database) → Return None
-            - Vague requests without context → CLARIFY_[TYPE]_NEEDED
-
-            RESPONSE FORMAT EXAMPLES:
-            "count activities" → MCP_TOOL: get_table_stats dsiactivities {{}}
-            "activities older than 10 days" → MCP_TOOL: get_table_stats dsiactivities {{"date_filter": "older than 10 days"}}
-            "count transactions older than 3 months" → MCP_TOOL: get_table_stats dsitransactionlog {{"date_filter": "older than 3 months"}}
-            "count of archived activities" → MCP_TOOL: get_table_stats dsiactivitiesarchive {{}}
-            "table statistics" → MCP_TOOL: get_table_stats {{}}
-            
-            NON-DATE FILTER EXAMPLES (use execute_sql_query):
-            "count all errors occured in transactions in sept" → MCP_TOOL: execute_sql_query {{"user_prompt": "count all errors occured in transactions in sept"}}
-            "show failed activities" → MCP_TOOL: execute_sql_query {{"user_prompt": "show failed activities"}}
-            "count successful transactions" → MCP_TOOL: execute_sql_query {{"user_prompt": "count successful transactions"}}
-            "list all warnings" → MCP_TOOL: execute_sql_query {{"user_prompt": "list all warnings"}}
-            "count activities where ActivityType is Event" → MCP_TOOL: execute_sql_query {{"user_prompt": "count activities where ActivityType is Event"}}
-            "list activities by server" → MCP_TOOL: execute_sql_query {{"user_prompt": "list activities by server"}}
-            "count transactions with error" → MCP_TOOL: execute_sql_query {{"user_prompt": "count transactions with error"}}
-            "activities where ServerName contains prod" → MCP_TOOL: execute_sql_query {{"user_prompt": "activities where ServerName contains prod"}}
-            "count activities older than 10 days where ActivityType is Event" → MCP_TOOL: execute_sql_query {{"user_prompt": "count activities older than 10 days where ActivityType is Event"}}
-            
-            OTHER EXAMPLES:
-            "archive activities older than 7 days" → MCP_TOOL: archive_records dsiactivities {{"date_filter": "older than 7 days"}}
-            "delete archived transactions older than 30 days" → MCP_TOOL: delete_archived_records dsitransactionlog {{"date_filter": "older than 30 days"}}
-            "show jobs" → MCP_TOOL: execute_sql_query {{"user_prompt": "show jobs"}}
-            "recent jobs" → MCP_TOOL: execute_sql_query {{"user_prompt": "recent jobs"}}
-            "failed jobs" → MCP_TOOL: execute_sql_query {{"user_prompt": "failed jobs"}}
-            "job statistics" → MCP_TOOL: execute_sql_query {{"user_prompt": "job statistics"}}
-            "analyse the reason for recent job fail" → MCP_TOOL: execute_sql_query {{"user_prompt": "analyse the reason for recent job fail"}}
-            "why did jobs fail" → MCP_TOOL: execute_sql_query {{"user_prompt": "why did jobs fail"}}
-            "activities by server" → MCP_TOOL: execute_sql_query {{"user_prompt": "activities by server"}}
-            "show activities where ActivityType is Event" → MCP_TOOL: execute_sql_query {{"user_prompt": "show activities where ActivityType is Event"}}
-            "region status" → MCP_TOOL: region_status {{}}
-            "hello" → None
-            "show data" (no context) → CLARIFY_TABLE_NEEDED
-
-            CRITICAL: Respond with ONLY one of these formats:
-            MCP_TOOL: [tool_name] [table_name] [filters_json]
-            CLARIFY_TABLE_NEEDED
-            CLARIFY_FILTERS_NEEDED  
-            CLARIFY_REQUEST_NEEDED
-            None
-
-            NO analysis, explanations, or additional text.
-            """
-            
-            url = f"{self.base_url}/chat/completions"
-            payload = {
-                "model": self.model_name,
-                "messages": [{"role": "user", "content": enhanced_prompt}],
-                "temperature": 0.1,  
-                "max_tokens": 100,   
-                "stop": ["\n\n", "Analysis:", "Step"]  # Stop tokens to prevent verbose responses
-            }
+            has_context = bool(conversation_context and "Previous conversation:" in conversation_context)
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            result_text = data["choices"][0]["message"]["content"].strip() if data["choices"] else ""
+            # Greetings, policy questions, off-topic chatter and destructive requests need neither
+            # context parsing nor an LLM call; the conversational handler answers them
+            if _is_non_database_message(user_message, has_context):
+                logger.info(f"Message is conversational, not database operation: '{user_message}'")
+                return None
+            user_msg_lower = user_message.lower()
+            
+            # Extract context information only when there is real history to parse
+            context_info = self._extract_context_info(conversation_context) if has_context else _EMPTY_CONTEXT_INFO
+            
+            # Common exact phrasings skip the LLM round-trip entirely
+            fast_route = _fast_classify(user_msg_lower, has_context)
+            if fast_route:
+                logger.info(f"Fast-path routed message '{user_message}' to '{fast_route}'")
+                return await self._parse_enhanced_mcp_response(fast_route, user_message)
+            
+            # Repeated questions against the same context reuse the earlier parsed route;
+            # the MCP tool itself always runs fresh
+            signature = _parse_signature(user_message, conversation_context, has_context)
+            cached_route = _get_cached_parse(signature)
+            if cached_route is not None:
+                logger.info(f"Reusing cached routing for message '{user_message}'")
+                tool_name, table_name, filters = cached_route
+                return await self._execute_mcp_tool(tool_name, table_name, dict(filters))
+            
+            result_text = await self._request_parse_completion(user_message, conversation_context, context_info,
+                                                               has_context, self.parse_model)
+            if self.escalation_model and self.escalation_model != self.parse_model and _needs_escalation(result_text):
+                logger.info(f"Escalating routing of '{user_message}' to {self.escalation_model} after reply '{result_text}'")
+                result_text = await self._request_parse_completion(user_message, conversation_context, context_info,
+                                                                   has_context, self.escalation_model)
             
             # Parse the enhanced LLM response
             if "MCP_TOOL:" in result_text:
-                return await self._parse_enhanced_mcp_response(result_text, user_message)
-            elif any(clarify in result_text for clarify in ["CLARIFY_TABLE_NEEDED", "CLARIFY_FILTERS_NEEDED", "CLARIFY_REQUEST_NEEDED"]):
+                route = self._parse_mcp_tool_line(result_text, user_message)
+                if not isinstance(route, tuple):
+                    return route
+                tool_name, table_name, filters = route
+                _store_cached_parse(signature, (tool_name, table_name, dict(filters)))
+                return await self._execute_mcp_tool(tool_name, table_name, filters)
+            elif _CLARIFY_TOKEN_RE.search(result_text):
                 # Handle clarification requests
                 return await self._handle_clarification_request(result_text, user_message)
             else:
                 # Check if LLM intentionally returned None for conversational handling
-                if result_text.strip().lower() in ['none', 'null', '']:
+                if result_text.strip().lower() in _EMPTY_ROUTE_REPLIES:
                     logger.info(f"LLM determined message is conversational, not database operation: '{user_message}'")
                 else:
                     logger.warning(f"Enhanced LLM did not return expected format for message '{user_message}'. LLM response: '{result_text}'")
                 
                 # Try to extract operation intent and provide fallback response for common cases
-                if self._is_job_logs_request(user_message):
-                    # Create fallback job logs operation 
-                    return await self._create_fallback_job_logs_operation(user_message, conversation_context)
-                elif self._is_archive_request(user_message):
-                    # Create fallback archive operation with context
-                    return await self._create_fallback_archive_operation(user_message, conversation_context)
-                elif self._is_stats_request(user_message):
-                    # Create fallback stats operation with context
-                    return await self._create_fallback_stats_operation(user_message, conversation_context)
-                
-                return None
+                return await self._create_fallback_operation(user_message, conversation_context, context_info)
                 
         except Exception as e:
-            logger.error(f"Enhanced LLM parsing failed for message '{user_message}': {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            # logger.exception attaches the traceback only when the record is actually emitted
+            logger.exception(f"Enhanced LLM parsing failed for message '{user_message}': {e}")
             
-            if self._is_job_logs_request(user_message):
-                return await self._create_fallback_job_logs_operation(user_message, conversation_context)
-            elif self._is_archive_request(user_message):
-                return await self._create_fallback_archive_operation(user_message, conversation_context)
-            elif self._is_stats_request(user_message):
-                return await self._create_fallback_stats_operation(user_message, conversation_context)
-            
-            return None
+            return await self._create_fallback_operation(user_message, conversation_context, context_info)
+
+    async def _create_fallback_operation(self, user_message: str, conversation_context: Optional[str] = None,
+                                         context_info: Optional[ContextInfo] = None) -> Any:
+        """Route a message the LLM could not handle to the matching keyword-based fallback operation"""
+        if self._is_job_logs_request(user_message):
+            # Create fallback job logs operation
+            return await self._create_fallback_job_logs_operation(user_message, conversation_context)
+        elif self._is_archive_request(user_message):
+            # Create fallback archive operation with context
+            return await self._create_fallback_archive_operation(user_message, conversation_context, context_info)
+        elif self._is_stats_request(user_message):
+            # Create fallback stats operation with context
+            return await self._create_fallback_stats_operation(user_message, conversation_context, context_info)
+        
+        return None
+
+    async def _request_parse_completion(self, user_message: str, conversation_context: Optional[str],
+                                        context_info: ContextInfo, has_context: bool, model: str) -> str:
+        """Ask the LLM to route a message and return its raw MCP_TOOL/CLARIFY/None reply"""
+        # Only this per-turn part of the prompt changes between calls
+        context_section = ""
+        if has_context:
+            context_section = _CONTEXT_SECTION_TEMPLATE.format(
+                conversation_context=conversation_context,
+                last_table=context_info.last_table,
+                last_filters=dict(context_info.last_filters),
+                last_operation=context_info.last_operation,
+                has_job_context=context_info.has_job_context
+            )
+        request_prompt = _REQUEST_PROMPT_TEMPLATE.format(user_message=user_message, context_section=context_section)
+        
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": _ENHANCED_PROMPT_PREFIX},
+                *_ROUTING_FEWSHOT_MESSAGES,
+                {"role": "user", "content": request_prompt}
+            ],
+            # Deterministic single-line decision; execute_sql_query replies echo the user's
+            # message, so the token budget grows with it (~3 characters per token)
+            "temperature": 0.0,
+            "top_p": 1.0,
+            "max_tokens": 48 + len(user_message) // 3,
+            "stop": ["\n", "Analysis:"]  # The reply is one line; stop at its end
+        }
+        if self.use_prompt_cache_key:
+            payload["prompt_cache_key"] = _ROUTING_PROMPT_CACHE_KEY
+        elif self.use_cache_prompt:
+            payload["cache_prompt"] = True
+        
+        # Stream the reply and stop at the end of the decision line
+        return await self._stream_chat_completion(payload, timeout=30, is_complete=_is_parse_reply_complete)
 
     async def _parse_enhanced_mcp_response(self, llm_response: str, original_message: str) -> Optional[Any]:
         """Parse enhanced LLM response and return structured result"""
+        route = self._parse_mcp_tool_line(llm_response, original_message)
+        if not isinstance(route, tuple):
+            # None or a clarification result for an invalid tool, table or filters
+            return route
+        return await self._execute_mcp_tool(*route)
+
+    def _parse_mcp_tool_line(self, llm_response: str, original_message: str) -> Any:
+        """Parse an MCP_TOOL reply into a (tool_name, table_name, filters) route
+        
+        Returns None when no usable line is found, or a clarification result when the
+        tool, table or filters are invalid.
+        """
         try:
             # Clean up the response and find the MCP_TOOL line
             cleaned_response = llm_response.strip()
             mcp_line = None
-                        
-            # Handle case where the entire response is the MCP_TOOL line
-            if cleaned_response.startswith("MCP_TOOL:"):
-                mcp_line = cleaned_response
-            else:
-                # Find the line with MCP_TOOL:
-                for line in cleaned_response.split('\n'):
-                    if "MCP_TOOL:" in line:
-                        mcp_line = line.strip()
-                        break
-                        
-            if not mcp_line:
-                logger.error(f"No MCP_TOOL line found in LLM response. Full response: '{llm_response}'. Original message: '{original_message}'")
-                return None
-            
-            # Parse the MCP_TOOL line: "MCP_TOOL: [tool_name] [table_name] [filters_json]"
-            # Handle tools that don't need table names specially to avoid JSON parsing issues
-            tools_without_tables = ["health_check", "region_status", "execute_sql_query"]
             
-            cleaned_line = mcp_line.replace("MCP_TOOL:", "").strip()
-            parts = cleaned_line.split(" ", 1)
-            tool_name = parts[0].strip() if len(parts) > 0 else ""
+            # Only the first line of a reply that opens with MCP_TOOL: is the route; anything
+            # after it ("Analysis: ...", a second line) must not leak into the table or filters
+            line_end = cleaned_response.find("\n")
+            first_line = cleaned_response if line_end == -1 else cleaned_response[:line_end].rstrip()
+            
+            # Fast path for the two hottest routes: the tool name is known, carve the rest directly
+            if first_line.startswith(_PFX_STATS):
+                mcp_line = first_line
+                tool_name, has_rest, rest = "get_table_stats", True, first_line[len(_PFX_STATS):]
+            elif first_line.startswith(_PFX_ARCH):
+                mcp_line = first_line
+                tool_name, has_rest, rest = "archive_records", True, first_line[len(_PFX_ARCH):]
+            else:
+                # Handle case where the response opens with the MCP_TOOL line
+                if first_line.startswith("MCP_TOOL:"):
+                    mcp_line = first_line
+                else:
+                    # Find the line with MCP_TOOL: by slicing around the marker, no line list needed
+                    index = cleaned_response.find("MCP_TOOL:")
+                    if index != -1:
+                        start = cleaned_response.rfind("\n", 0, index) + 1
+                        end = cleaned_response.find("\n", index)
+                        mcp_line = cleaned_response[start:end if end != -1 else None].strip()
+                            
+                if not mcp_line:
+                    logger.error(f"No MCP_TOOL line found in LLM response. Full response: '{llm_response}'. Original message: '{original_message}'")
+                    return None
+                
+                # Parse the MCP_TOOL line: "MCP_TOOL: [tool_name] [table_name] [filters_json]"
+                # Handle tools that don't need table names specially to avoid JSON parsing issues
+                
+                cleaned_line = mcp_line.replace("MCP_TOOL:", "").strip()
+                tool_name, has_rest, rest = cleaned_line.partition(" ")
+                tool_name = tool_name.strip()
             
-            if tool_name in tools_without_tables:
+            if tool_name in self._TOOLS_WITHOUT_TABLES:
                 # For tools without tables, everything after tool name is filters
                 table_name = ""
-                filters_str = parts[1].strip() if len(parts) > 1 else "{}"
+                filters_str = rest.strip() if has_rest else "{}"
             else:
-                # For tools with tables, split normally
-                all_parts = cleaned_line.split(" ", 2)
-                table_name = all_parts[1].strip() if len(all_parts) > 1 else ""
-                filters_str = all_parts[2].strip() if len(all_parts) > 2 else "{}"
+                # For tools with tables, carve the table off the remainder
+                table_name, has_filters, filters_str = rest.partition(" ")
+                table_name = table_name.strip()
+                filters_str = filters_str.strip() if has_filters else "{}"
                 
                 # Special case: if table_name looks like a JSON object, it's actually filters for a general query
                 if table_name.startswith('{') and table_name.endswith('}'):
@@ -502,453 +1682,186 @@ class OpenAIService:
                     table_name = ""
             
             # Validate tool name is not empty and is valid
-            valid_tools = ["get_table_stats", "archive_records", "delete_archived_records", "health_check", "region_status", "execute_sql_query"]
             if not tool_name:
                 logger.error(f"Empty tool name in MCP_TOOL line: '{mcp_line}'. Original message: '{original_message}'")
                 return None
-            elif tool_name not in valid_tools:
-                logger.warning(f"Invalid tool name '{tool_name}' provided by LLM. Valid tools: {valid_tools}")
-                # Create error result for invalid tool name
-                class InvalidToolResult:
-                    def __init__(self, tool_name):
-                        self.is_clarification_request = True
-                        self.clarification_message = (
-                            f"I encountered an invalid operation '{tool_name}'. "
-                            "I can help you with the following operations:\n\n"
-                            "Available Operations:\n"
-                            "• Count/Statistics: \"Count activities\", \"Activities older than 10 days\", \"Table statistics\"\n"
-                            "• Archive Data: \"Archive activities older than 7 days\", \"Archive old transactions\"\n"
-                            "• Delete Data: \"Delete archived activities older than 30 days\" (permanent removal)\n"
-                            "• System Info: \"Health check\", \"Region status\", \"Database status\"\n"
-                            "• Custom Queries: Complex WHERE conditions, analysis queries\n\n"
-                        )
-                        self.is_database_operation = False
-                        self.tool_used = None
-                        self.table_used = None
-                        # Don't set mcp_result for clarification requests
-                        self.mcp_result = None
-                return InvalidToolResult(tool_name)
+            elif tool_name not in self._VALID_TOOLS:
+                logger.warning(f"Invalid tool name '{tool_name}' provided by LLM. Valid tools: {sorted(self._VALID_TOOLS)}")
+                return ClarificationResult(_INVALID_TOOL_MESSAGE.format(tool_name=tool_name))
             
             # Validate table name if provided (some tools don't need table names)
-            valid_tables = ["dsiactivities", "dsitransactionlog", "dsiactivitiesarchive", "dsitransactionlogarchive", ""]
-            requires_table = tool_name not in tools_without_tables
-            
             # Special case: get_table_stats can work with empty table name for general database stats
             if tool_name == "get_table_stats" and not table_name:
                 # This is valid - general database stats
                 pass
-            elif table_name and table_name not in valid_tables:
+            elif table_name and table_name not in self._VALID_TABLES:
                 # For get_table_stats with invalid table name, try to use general database stats instead
                 if tool_name == "get_table_stats":
                     table_name = ""  # Use empty table name for general stats
                 else:
-                    # Create error result for invalid table name
-                    class InvalidTableResult:
-                        def __init__(self, table_name):
-                            self.is_clarification_request = True
-                            self.clarification_message = (
-                                f"Please specify one of the following valid tables:\n\n"
-                                "Available Tables:\n\n"
-                                "• dsiactivities - Current activity logs\n"
-                                "• dsitransactionlog - Current transaction logs\n"
-                                "• dsiactivitiesarchive - Archived activity logs\n"
-                                "• dsitransactionlogarchive - Archived transaction logs\n\n"
-                            )
-                            self.is_database_operation = False
-                            self.tool_used = None
-                            self.table_used = None
-                            # Don't set mcp_result for clarification requests
-                            self.mcp_result = None
-                    return InvalidTableResult(table_name)
+                    return ClarificationResult(_INVALID_TABLE_MESSAGE)
             
             # Parse filters JSON
             try:
-                filters_data = json.loads(filters_str) if filters_str else {}
+                # Empty filters ("{}") are by far the most common reply, so skip the decoder for them
+                filters_data = orjson.loads(filters_str) if filters_str not in _EMPTY_FILTER_STRINGS else {}
                 filters = filters_data if isinstance(filters_data, dict) else {}
             except json.JSONDecodeError as e:
                 logger.warning(f"Failed to parse filters JSON '{filters_str}': {e}")
-                # Create error result for invalid filters
-                class InvalidFiltersResult:
-                    def __init__(self, filters_str, error):
-                        self.is_clarification_request = True
-                        self.clarification_message = (
-                            f"I had trouble understanding the filter criteria. "
-                            "Please provide clearer date or filter information:\n\n"
-                            "📅 Date Filter Examples:\n"
-                            "• \"records older than 10 months\"\n"
-                            "• \"data from last year\"\n"
-                            "• \"recent activities\"\n\n"
-                        )
-                        self.is_database_operation = False
-                        self.tool_used = None
-                        self.table_used = None
-                        # Don't set mcp_result for clarification requests
-                        self.mcp_result = None
-                return InvalidFiltersResult(filters_str, e)
-                # Use empty filters as fallback
-                filters = {}
-            
-            # Execute the MCP tool
-            from cloud_mcp.server import (
-                archive_records, delete_archived_records, 
-                get_table_stats, health_check, region_status
-            )
+                return ClarificationResult(_INVALID_FILTERS_MESSAGE)
             
+            return tool_name, table_name, filters
+            
+        except Exception as e:
+            logger.error(f"Enhanced MCP response parsing failed: {e}")
+            return None
+
+    async def _execute_mcp_tool(self, tool_name: str, table_name: str, filters: Dict[str, Any]) -> Optional[Any]:
+        """Run a parsed MCP route and wrap the outcome in a result object"""
+        try:
             mcp_result = None
+            dispatch = _mcp_tool_dispatch().get(tool_name)
             
-            if tool_name == "archive_records" and table_name:
-                mcp_result = await archive_records(table_name, filters, "system")
-            elif tool_name == "delete_archived_records" and table_name:
-                mcp_result = await delete_archived_records(table_name, filters, "system")
-            elif tool_name == "get_table_stats":
-                # Handle both specific table stats and general database stats
-                if table_name:
-                    mcp_result = await get_table_stats(table_name, filters)
-                else:
-                    # General database stats - use database service directly
-                    from services.region_service import get_region_service
-                    from services.database_service import DatabaseService
-                    
-                    try:
-                        region_service = get_region_service()
-                        current_region = region_service.get_current_region() or region_service.get_default_region()
-                        region_db_session = region_service.get_session(current_region)
-                        
-                        try:
-                            db_service = DatabaseService(region_db_session)
-                            mcp_result = await db_service.get_detailed_table_stats()
-                        finally:
-                            region_db_session.close()
-                    except Exception as e:
-                        logger.error(f"Error getting general database stats: {e}")
-                        mcp_result = {
-                            "success": False,
-                            "error": f"Failed to get general database statistics: {str(e)}"
-                        }
-            elif tool_name == "health_check":
-                mcp_result = await health_check()
-            elif tool_name == "region_status":
-                mcp_result = await region_status()
-            elif tool_name == "query_job_logs":
-                from cloud_mcp.server import _query_job_logs
-                mcp_result = await _query_job_logs(filters)
-            elif tool_name == "get_job_summary_stats":
-                from cloud_mcp.server import _get_job_summary_stats
-                mcp_result = await _get_job_summary_stats(filters)
-            elif tool_name == "execute_sql_query":
-                from cloud_mcp.server import _execute_sql_query
-                user_prompt = filters.get("user_prompt", "") if filters else ""
-                mcp_result = await _execute_sql_query(user_prompt, filters)
+            if tool_name == "get_table_stats" and not table_name:
+                # General database stats - use database service directly
+                try:
+                    region_service = get_region_service()
+                    current_region = region_service.get_current_region() or region_service.get_default_region()
+                    mcp_result = await _detailed_table_stats(current_region)
+                except Exception as e:
+                    logger.error(f"Error getting general database stats: {e}")
+                    mcp_result = {
+                        "success": False,
+                        "error": f"Failed to get general database statistics: {str(e)}"
+                    }
+            elif dispatch and (table_name or dispatch[1] not in _TABLE_REQUIRED_SIGNATURES):
+                # Execute the MCP tool with the argument shape it expects
+                tool, signature = dispatch
+                mcp_result = await _MCP_CALL_ADAPTERS[signature](tool, table_name, filters)
                 
                 # Extract table name from SQL query if available
-                if mcp_result and mcp_result.get('generated_sql') and not table_name:
+                if tool_name == "execute_sql_query" and mcp_result and mcp_result.get('generated_sql') and not table_name:
                     table_name = self._extract_primary_table_from_sql(mcp_result['generated_sql'])
             else:  
                 logger.warning(f"Unknown MCP tool or missing table: tool={tool_name}, table={table_name}")
             
-            # Create result object with MCP data and context preservation
-            class EnhancedLLMResult:
-                def __init__(self, tool, table, filters, mcp_result, context_preserved=False):
-                    self.tool_used = tool
-                    self.table_used = table
-                    self.filters = filters
-                    self.mcp_result = mcp_result
-                    self.is_database_operation = True
-                    self.operation = None  # Will be handled by MCP result
-                    self.context_preserved = context_preserved
-                    # Store for future context reference
-                    self.context_info = {
-                        "table": table,
-                        "filters": filters,
-                        "operation": tool
-                    }
             
-            result_obj = EnhancedLLMResult(tool_name, table_name, filters, mcp_result, context_preserved=False)
-            return result_obj
+            # Create result object with MCP data and context preservation
+            return EnhancedLLMResult(tool_name, table_name, filters, mcp_result, context_preserved=False)
             
         except Exception as e:
-            logger.error(f"Enhanced MCP response parsing failed: {e}")
+            logger.error(f"MCP tool execution failed: {e}")
             return None
 
     def _is_job_logs_request(self, message: str) -> bool:
         """Check if message is requesting job logs/execution information - INCLUDES COUNTING QUERIES"""
         message_lower = message.lower().strip()
         
-        # EXACT job execution patterns
-        exact_job_patterns = [
-            'show jobs', 'list jobs', 'job logs', 'recent jobs',
-            'last job', 'latest job', 'job statistics', 'job summary',
-            'failed jobs', 'successful jobs', 'job status'
-        ]
-        
-        # Job counting patterns - NEW!
-        job_counting_patterns = [
-            'how many job logs', 'count job logs', 'job logs count', 'total job logs',
-            'how many jobs', 'count jobs', 'jobs count', 'total jobs',
-            'number of job logs', 'number of jobs'
-        ]
-        
-        # Job analysis patterns - NEW!
-        job_analysis_patterns = [
-            'job failure analysis', 'job fail analysis', 'analyse job fail', 'analyze job fail',
-            'job failure reasons', 'why jobs fail', 'job error analysis', 'job issue analysis'
-        ]
-        
         # Check if message exactly matches or starts with exact patterns
-        for pattern in exact_job_patterns:
-            if message_lower == pattern or message_lower.startswith(pattern + ' '):
-                return True
-        
-        # Check for job counting patterns - NEW!
-        for pattern in job_counting_patterns:
-            if pattern in message_lower:
-                return True
-        
-        # Check for job analysis patterns - NEW!
-        for pattern in job_analysis_patterns:
-            if pattern in message_lower:
-                return True
+        if message_lower in _JOB_EXACT_PATTERNS or message_lower.startswith(_JOB_EXACT_PREFIXES):
+            return True
         
-        # Check for variations with "there are" or similar
-        if 'job log' in message_lower and any(word in message_lower for word in ['how many', 'count', 'total', 'number of']):
+        # Check for job counting and job analysis patterns
+        if _JOB_PHRASE_RE.search(message_lower):
             return True
         
-        if 'jobs' in message_lower and any(word in message_lower for word in ['how many', 'count', 'total', 'number of']):
+        # Check for variations with "there are" or similar ('job log' and 'jobs' both contain 'job')
+        if ('job log' in message_lower or 'jobs' in message_lower) and _JOB_COUNT_WORD_RE.search(message_lower):
             return True
         
         # Check for analysis queries containing job/jobs
-        if any(word in message_lower for word in ['job', 'jobs']) and any(analysis_word in message_lower for analysis_word in ['analys', 'reason', 'why', 'cause', 'fail']):
+        if 'job' in message_lower and _JOB_ANALYSIS_WORD_RE.search(message_lower):
             return True
         
         return False
 
+    def _is_factual_intent(self, message: str) -> bool:
+        """Check if message is a database/stats/archive request rather than free-form conversation"""
+        return _FACTUAL_INTENT_RE.search(message.lower()) is not None
+
     def _is_archive_request(self, message: str) -> bool:
         """Check if message is requesting an archive operation - EXACT OPERATIONAL PHRASES ONLY"""
-        message_lower = message.lower().strip()
-        
-        # Check for policy/explanation questions first (these should not be archive operations)
-        explanation_indicators = [
-            'what does', 'what is', 'explain', 'how does', 'policy', 'means what',
-            'for how much', 'can you explain'
-        ]
+        message_lower = message.lower()
         
         # If it's clearly asking for explanation/policy, it's not an operation request
-        if any(indicator in message_lower for indicator in explanation_indicators) and 'archive' in message_lower:
+        if _EXPLANATION_RE.search(message_lower) and 'archive' in message_lower:
             return False
         
         # EXACT operational archive phrases only - very restrictive
-        exact_archive_patterns = [
-            'archive records', 'archive old data', 'start archive',
-            'archive activities', 'archive transactions', 'archive old records'
-        ]
-        
-        # Check if message exactly matches these operational patterns
-        for pattern in exact_archive_patterns:
-            if pattern in message_lower:
-                return True
-        
-        return False
+        return _ARCHIVE_OPERATION_RE.search(message_lower) is not None
 
     def _is_stats_request(self, message: str) -> bool:
         """Check if message is requesting simple statistics/counts - IMPROVED PATTERN MATCHING"""
-        message_lower = message.lower().strip()
+        message_lower = message.lower()
         
         # EXCLUDE job-related queries first - these should use SQL tool
-        job_exclusion_patterns = [
-            'job logs', 'job log', 'jobs', 'job execution', 'job status',
-            'job failure', 'job success', 'job summary', 'job statistics'
-        ]
-        
-        # If it's a job-related query, don't treat as stats request
-        if any(pattern in message_lower for pattern in job_exclusion_patterns):
+        if _STATS_JOB_EXCLUSION_RE.search(message_lower):
             return False
         
-        # Main table counting patterns
-        main_table_patterns = [
-            'count activities', 'activities count', 'total activities',
-            'count transactions', 'transactions count', 'total transactions',
-            'table statistics', 'database statistics', 'show table stats',
-            'database overview', 'table summary'
-        ]
-        
-        # Archived table counting patterns - NEW!
-        archived_patterns = [
-            'count of archived activities', 'archived activities count', 'total archived activities',
-            'count of archived transactions', 'archived transactions count', 'total archived transactions',
-            'count archived activities', 'count archived transactions',
-            'archived activities statistics', 'archived transactions statistics',
-            'show archived activities count', 'show archived transactions count'
-        ]
-        
-        # Flexible counting patterns with "of" - NEW!
-        flexible_patterns = [
-            'count of activities', 'count of transactions',
-            'total count of activities', 'total count of transactions'
-        ]
-        
-        # Date-filtered counting patterns - NEW! (This is the key missing pattern)
-        date_filtered_patterns = [
-            'activities older than', 'transactions older than',
-            'activities from', 'transactions from',
-            'recent activities', 'recent transactions',
-            'activities in', 'transactions in',
-            'activities between', 'transactions between',
-            'activities last', 'transactions last',
-            'activities this', 'transactions this'
-        ]
-        
         # Check for non-date filters that should use SQL tool instead
         # Use the same logic as _has_non_date_filters method
         if self._has_non_date_filters(message):
             return False
         
-        # Check for main table patterns
-        for pattern in main_table_patterns:
-            if pattern in message_lower:
-                # Already checked for non-date filters above, so this is safe for stats tool
-                return True
-        
-        # Check for date-filtered patterns - CRITICAL for "activities older than 10 days"
-        for pattern in date_filtered_patterns:
-            if pattern in message_lower:
-                # Make sure it's not asking for complex analysis or reasoning
-                if not any(condition in message_lower for condition in ['analyse', 'analyze', 'why', 'reason']):
-                    return True
-        
-        # Check for archived table patterns - NEW!
-        for pattern in archived_patterns:
-            if pattern in message_lower:
-                # Allow "archived" requests without additional filtering restrictions
-                return True
-        
-        # Check for flexible patterns - NEW!
-        for pattern in flexible_patterns:
-            if pattern in message_lower:
-                # Allow simple "count of" requests
-                return True
-        
-        # Special patterns for database overview
-        overview_patterns = [
-            'overview of all database tables',
-            'overview of database tables',
-            'all database tables',
-            'database overview'
-        ]
-        
-        if any(pattern in message_lower for pattern in overview_patterns):
+        # Main table, archived table, "count of" and database overview phrasings
+        if _STATS_PHRASE_RE.search(message_lower):
             return True
         
-        return False
+        # Date-filtered counting - CRITICAL for "activities older than 10 days",
+        # unless it's asking for complex analysis or reasoning
+        return bool(_STATS_DATE_PHRASE_RE.search(message_lower)) and not _ANALYSIS_RE.search(message_lower)
 
     def _has_non_date_filters(self, message: str) -> bool:
         """Check if message contains filters other than date filters"""
         message_lower = message.lower().strip()
         
         # Phrase-based filters (exact substring matches)
-        phrase_filters = [
-            'where', 'like', 'containing', 'specific', 'particular', 'activitytype', 
-            'servername', 'by server', 'with error', 'status', 'type', 'contains',
-            'equals', 'is event', 'is error', 'name like', 'server like',
-            'activity type', 'transaction type', 'error type', 'where activitytype',
-            'where servername', 'where status', 'where type'
-        ]
-        
-        # Standalone keywords that indicate field-specific filtering
-        keyword_filters = [
-            'error', 'errors', 'failed', 'success', 'successful', 'warning', 'warnings',
-            'exception', 'exceptions', 'timeout', 'timeouts', 'cancelled', 'canceled',
-            'completed', 'pending', 'running', 'stopped', 'paused', 'retry', 'retries'
-        ]
-        
-        # Check for phrase-based filters
-        if any(filter_term in message_lower for filter_term in phrase_filters):
+        if _FILTER_PHRASE_RE.search(message_lower):
             return True
             
         # Check for standalone keyword filters (but avoid false positives with common words)
-        # Only trigger if the keyword appears in a filtering context
-        for keyword in keyword_filters:
-            if keyword in message_lower:
-                # Make sure it's not just part of a table name or casual mention
-                # Look for filtering context words nearby
-                context_words = ['count', 'show', 'list', 'find', 'get', 'all', 'only', 'with']
-                if any(context in message_lower for context in context_words):
-                    return True
-        
-        return False
-
-    def _extract_primary_table_from_sql(self, sql: str) -> str:
-        """Extract the primary table name from a SQL query"""
-        try:
-            sql_lower = sql.lower()
-            
-            # Look for FROM clause
-            if ' from ' in sql_lower:
-                from_index = sql_lower.find(' from ')
-                remaining = sql_lower[from_index + 6:].strip()
-                
-                # Extract table name (first word after FROM)
-                table_name = remaining.split()[0] if remaining.split() else ""
-                
-                # Clean table name (remove quotes, brackets, etc.)
-                table_name = table_name.strip('"\'`[]')
-                
-                # Return valid table names only
-                valid_tables = ["dsiactivities", "dsitransactionlog", "dsiactivitiesarchive", "dsitransactionlogarchive", "job_logs"]
-                if table_name in valid_tables:
-                    return table_name
-            
-            return ""
-        except Exception as e:
-            logger.warning(f"Error extracting table from SQL: {e}")
-            return ""
+        # Only trigger if the keyword appears in a filtering context. Tokenizing once means
+        # "count" no longer matches inside "account" or "all" inside "call".
+        if not _FILTER_KEYWORD_RE.search(message_lower):
+            return False
+        tokens = set(message_lower.translate(_PUNCT_TO_SPACE).split())
+        return not tokens.isdisjoint(_FILTER_CONTEXT_WORDS)
 
-    async def _create_fallback_archive_operation(self, user_message: str, conversation_context: str = None) -> Any:
+    async def _create_fallback_archive_operation(self, user_message: str, conversation_context: str = None,
+                                                 context_info: Optional[ContextInfo] = None) -> Any:
         """Create fallback archive operation with separate table and filter context handling"""
         try:
-            from cloud_mcp.server import archive_records
+            archive_records = _mcp_tool("archive_records")
             
-            # Extract context information
-            context_info = self._extract_context_info(conversation_context)
+            # Extract context information unless the caller already did
+            if context_info is None:
+                context_info = self._extract_context_info(conversation_context)
+            
+            user_msg_lower = user_message.lower()
             
             # Determine table using improved context-awareness
-            table_name = self._determine_table_from_context(user_message, context_info)
+            table_name = self._determine_table_from_context(user_message, context_info, user_msg_lower)
             
             # Determine filters using context-awareness
-            filters = self._determine_filters_from_context(user_message, context_info)
+            filters = self._determine_filters_from_context(user_message, context_info, user_msg_lower)
                         
             # Execute archive operation
             mcp_result = await archive_records(table_name, filters, "system")
             
-            # Create result object with context preservation indicator
-            class EnhancedLLMResult:
-                def __init__(self, tool, table, filters, mcp_result, context_preserved=False):
-                    self.tool_used = tool
-                    self.table_used = table
-                    self.filters = filters
-                    self.mcp_result = mcp_result
-                    self.is_database_operation = True
-                    self.operation = None
-                    self.context_preserved = context_preserved
-                    # Store for future context reference
-                    self.context_info = {
-                        "table": table,
-                        "filters": filters,
-                        "operation": tool
-                    }
-            
-            context_used = bool(context_info.get('last_table'))
+            context_used = bool(context_info.last_table)
             return EnhancedLLMResult("archive_records", table_name, filters, mcp_result, context_used)
             
         except Exception as e:
             logger.error(f"Fallback archive operation failed: {e}")
             return None
 
-    async def _create_fallback_stats_operation(self, user_message: str, conversation_context: str = None) -> Any:
+    async def _create_fallback_stats_operation(self, user_message: str, conversation_context: str = None,
+                                               context_info: Optional[ContextInfo] = None) -> Any:
         """Create fallback stats operation with separate table and filter context handling"""
         try:
             # Check if message has non-date filters - if so, use SQL tool instead
             if self._has_non_date_filters(user_message):
-                from cloud_mcp.server import _execute_sql_query
+                _execute_sql_query = _mcp_tool("execute_sql_query")
                 
                 # Route to SQL tool for queries with non-date filters
                 filters = {"user_prompt": user_message}
@@ -959,61 +1872,33 @@ class OpenAIService:
                 if mcp_result and mcp_result.get('generated_sql'):
                     table_name = self._extract_primary_table_from_sql(mcp_result['generated_sql'])
                 
-                # Create result object
-                class EnhancedLLMResult:
-                    def __init__(self, tool, table, filters, mcp_result, context_preserved=False):
-                        self.tool_used = tool
-                        self.table_used = table
-                        self.filters = filters
-                        self.mcp_result = mcp_result
-                        self.is_database_operation = True
-                        self.operation = None
-                        self.context_preserved = context_preserved
-                        self.context_info = {
-                            "table": table,
-                            "filters": filters,
-                            "operation": tool
-                        }
                 
                 return EnhancedLLMResult("execute_sql_query", table_name, filters, mcp_result, False)
             
             # Otherwise, use regular stats operation for date-only or no filters
-            from cloud_mcp.server import get_table_stats
+            get_table_stats = _mcp_tool("get_table_stats")
             
-            # Extract context information
-            context_info = self._extract_context_info(conversation_context)
+            # Extract context information unless the caller already did
+            if context_info is None:
+                context_info = self._extract_context_info(conversation_context)
+            
+            user_msg_lower = user_message.lower()
             
             # Determine table using improved context-awareness
-            table_name = self._determine_table_from_context(user_message, context_info)
+            table_name = self._determine_table_from_context(user_message, context_info, user_msg_lower)
             
             # Determine filters using context-awareness
-            filters = self._determine_filters_from_context(user_message, context_info)
+            filters = self._determine_filters_from_context(user_message, context_info, user_msg_lower)
             
             # Special handling for yesterday queries that might be misrouted
-            if "yesterday" in user_message.lower() and not filters:
+            if "yesterday" in user_msg_lower and not filters:
                 filters = {"date_filter": "yesterday"}
                         
             # Execute stats operation
             mcp_result = await get_table_stats(table_name, filters)
             
-            # Create result object with context preservation indicator
-            class EnhancedLLMResult:
-                def __init__(self, tool, table, filters, mcp_result, context_preserved=False):
-                    self.tool_used = tool
-                    self.table_used = table
-                    self.filters = filters
-                    self.mcp_result = mcp_result
-                    self.is_database_operation = True
-                    self.operation = None
-                    self.context_preserved = context_preserved
-                    # Store for future context reference
-                    self.context_info = {
-                        "table": table,
-                        "filters": filters,
-                        "operation": tool
-                    }
             
-            context_used = bool(context_info.get('last_table'))
+            context_used = bool(context_info.last_table)
             return EnhancedLLMResult("get_table_stats", table_name, filters, mcp_result, context_used)
             
         except Exception as e:
@@ -1023,7 +1908,7 @@ class OpenAIService:
     async def _create_fallback_job_logs_operation(self, user_message: str, conversation_context: str = None) -> Any:
         """Create fallback job logs operation for job execution queries"""
         try:
-            from cloud_mcp.server import _query_job_logs
+            _query_job_logs = _mcp_tool("query_job_logs")
             
             # Default filters for most job execution queries - limit all job lists to 5
             filters = {"limit": 5, "format": "table"}
@@ -1031,15 +1916,7 @@ class OpenAIService:
             # Check for specific patterns that might need different handling
             user_msg_lower = user_message.lower()
             
-            # If asking for multiple jobs, keep limit at 5
-            if any(plural in user_msg_lower for plural in ['jobs', 'recent jobs', 'show jobs']):
-                filters["limit"] = 5
-                filters["format"] = "table"  
-            
-            # If asking for ALL jobs, still limit to 5 for consistency
-            if any(all_pattern in user_msg_lower for all_pattern in ['all jobs', 'get all jobs']):
-                filters["limit"] = 5
-                filters["format"] = "table"  
+            # Lists of jobs, including "all jobs", keep the default limit of 5
             
             # Detect job type filters (including past tense patterns)
             if 'archive job' in user_msg_lower or 'job archived' in user_msg_lower or 'archived job' in user_msg_lower:
@@ -1087,8 +1964,8 @@ class OpenAIService:
                 filters["format"] = "table"  
             
             # If asking for job statistics/summary
-            if any(stat in user_msg_lower for stat in ['statistics', 'summary', 'stats']):
-                from cloud_mcp.server import _get_job_summary_stats
+            if _JOB_STATS_WORD_RE.search(user_msg_lower):
+                _get_job_summary_stats = _mcp_tool("get_job_summary_stats")
                 mcp_result = await _get_job_summary_stats(filters)
                 tool_name = "get_job_summary_stats"
             else:
@@ -1096,23 +1973,8 @@ class OpenAIService:
                 mcp_result = await _query_job_logs(filters)
                 tool_name = "query_job_logs"
             
-            # Create result object
-            class EnhancedLLMResult:
-                def __init__(self, tool, filters, mcp_result):
-                    self.tool_used = tool
-                    self.table_used = "" 
-                    self.filters = filters
-                    self.mcp_result = mcp_result
-                    self.is_database_operation = True
-                    self.operation = None
-                    self.context_preserved = False
-                    self.context_info = {
-                        "table": "",
-                        "filters": filters,
-                        "operation": tool
-                    }
             
-            return EnhancedLLMResult(tool_name, filters, mcp_result)
+            return EnhancedLLMResult(tool_name, "", filters, mcp_result)
             
         except Exception as e:
             logger.error(f"Fallback job logs operation failed: {e}")
@@ -1121,47 +1983,9 @@ class OpenAIService:
     async def _handle_clarification_request(self, llm_response: str, original_message: str) -> Any:
         """Handle cases where LLM needs clarification about table names or filters"""
         try:
-            clarification_message = ""
-            
-            if "CLARIFY_TABLE_NEEDED" in llm_response:
-                clarification_message = (
-                    "I need clarification about which table you'd like to work with. "
-                    "Please specify one of the following:\n\n"
-                    "Available Tables:\n"
-                    "• dsiactivities - Current activity logs\n"
-                    "• dsitransactionlog - Current transaction logs\n"
-                    "• dsiactivitiesarchive - Archived activity logs\n"
-                    "• dsitransactionlogarchive - Archived transaction logs\n\n"
-                )
-            elif "CLARIFY_FILTERS_NEEDED" in llm_response:
-                clarification_message = (
-                    "I need more specific information about the date or filter criteria. "
-                    "Please provide more details:\n\n"
-                    "Date Filter Examples:\n"
-                    "• \"records older than 10 months\"\n"
-                    "• \"data from last year\"\n"
-                    "• \"recent activities\"\n"
-                )
-            elif "CLARIFY_REQUEST_NEEDED" in llm_response:
-                clarification_message = (
-                    "I'm not sure what you'd like me to do. Could you please clarify your request?\n\n"
-                    "I can help you with:\n\n"
-                    "• View Data: \"Show table statistics\" or \"Count activities\"\n"
-                    "• Archive Data: \"Archive old records\" or \"Archive activities older than 7 days\"\n"
-                    "• Delete Data: \"Delete archived records\" (with proper date filters)\n"
-                    "• System Info: \"Health check\" or \"Database status\"\n\n"
-                )
-            
-            # Create a clarification result object
-            class ClarificationResult:
-                def __init__(self, message):
-                    self.is_clarification_request = True
-                    self.clarification_message = message
-                    self.is_database_operation = False
-                    self.tool_used = None
-                    self.table_used = None 
-                    # Don't set mcp_result for clarification requests to avoid confusion
-                    self.mcp_result = None
+            # Clarification tokens are mutually exclusive in practice, so the first one decides
+            match = _CLARIFY_TOKEN_RE.search(llm_response)
+            clarification_message = _CLARIFICATION_MESSAGES[match.group(0)] if match else ""
             
             return ClarificationResult(clarification_message)
             
@@ -1170,144 +1994,94 @@ class OpenAIService:
             return None
 
     def get_system_prompt(self) -> str:
-       """Get the system prompt for log management context"""
-       from datetime import datetime
-       current_date = datetime.now().strftime("%Y-%m-%d")
-       current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-       
-       return f"""You are an AI agent for Cloud Inventory Log Management System.
-
-            CURRENT DATE: {current_date}
-            CURRENT DATE & TIME: {current_datetime}
-
-            - CAPABILITIES:
-            • Query database tables (dsiactivities, dsitransactionlog, and their _archive versions)
-            • Guide archiving and data management operations
-            • Check region connection status and current region information
-            • Explain safety rules and validate user requests
-
-            - CRITICAL SAFETY RULES:
-            • Archive: Records must be >7 days old
-            • Delete: Only archived records >30 days old
-            • Operations require date filters and confirmation
-            • All operations are logged and role-restricted
-
-            - DATE FORMAT: YYYYMMDDHHMMSS (e.g., 20240315123000)
-
-            - HANDLING DIFFERENT TYPES OF USER INPUTS:
-
-            1. GREETINGS & CASUAL CONVERSATION:
-            • For "hello", "hi", "how are you", etc. - Respond warmly and introduce your capabilities
-            • Example: "Hello! I'm your Cloud Inventory Log Management agent. I can help you view database statistics, guide archiving operations, and explain safety procedures."
-
-            2. GENERAL QUESTIONS ABOUT THE SYSTEM:
-            • For questions about policies, procedures, or how things work - Provide informative explanations
-            • Example: "What is archiving?" → Explain the archiving process, safety rules, and benefits
-            • Example: "What can you do?" → List your capabilities with examples
-
-            3. OUT-OF-CONTEXT REQUESTS:
-            • For requests completely unrelated to log management (weather, cooking, etc.) - Politely redirect to your domain
-            • Example: "I'm specialized in Cloud Inventory Log Management. I can help you with database operations, archiving procedures, and system statistics. What would you like to know about your log data?"
-
-            4. DESTRUCTIVE/DANGEROUS REQUESTS:
-            • For destructive operations outside your mandate (delete database, drop table, truncate, etc.) - Firmly decline with security explanation
-            • Example: "Delete Database" → "I cannot and will not perform destructive database operations like deleting entire databases or dropping tables. I'm designed with safety-first principles and only support controlled archiving operations with built-in safeguards. I can help you with safe data management within established policies."
-            • Example: "Drop table" → "I don't have permissions to drop tables or perform destructive schema operations. My role is limited to safe data viewing and controlled archiving with multiple safety checks. Would you like to see table statistics or learn about our archiving procedures instead?"
-            • Emphasize safety controls and redirect to approved operations
-
-            5. VAGUE DATABASE REQUESTS:
-            • For unclear data requests like "show data", "check something" - Ask specific clarifying questions
-            • Provide examples of what you can do rather than generic error messages
-            • Example: "I'd be happy to help! Could you specify what data you'd like to see? For example: 'Show activities statistics' or 'Count transactions older than 30 days'"
-
-            6. TECHNICAL QUESTIONS:
-            • For questions about database structure, table relationships, etc. - Provide detailed technical explanations
-            • Include table names, purposes, and relationships
-
-            7. SPECIFIC DATABASE OPERATIONS:
-            • For clear requests about tables, archiving, statistics - Process normally and provide structured responses
-            • Available tables: dsiactivities, dsitransactionlog, dsiactivitiesarchive, dsitransactionlogarchive
+       """Get the static system prompt for log management context"""
+       return _SYSTEM_PROMPT
+    
+    def get_system_date_context(self) -> str:
+       """Get the current date and time block that follows the static system prompt"""
+       return _system_date_message(int(time.time()))["content"]
 
-            8. ERROR HANDLING GUIDELINES:
-            • Don't always default to the same clarification message
-            • Tailor your response to the type of confusion or vagueness
-            • If table names are unclear → Ask specifically about which table
-            • If date criteria are vague → Ask specifically about time ranges
-            • If the entire request is unclear → Ask about the goal they're trying to achieve
+    def _build_chat_payload(self, user_message: str, conversation_context: Optional[str], has_history: bool) -> Dict[str, Any]:
+        """Build the general chat completion payload from the system prompt, history and message"""
+        # Prepare messages for OpenAI chat format; the static prompt leads so its prefix
+        # stays cacheable, and the changing date follows in its own system message. Both
+        # message dicts are shared across requests, so only the list is built per call
+        messages = [_SYSTEM_MESSAGE, _system_date_message(int(time.time()))]
+        
+        # Add conversation context if available (includes previous exchanges)
+        if has_history:
+            # Parse conversation context into individual messages in one regex pass
+            history = [
+                {"role": _CONTEXT_TURN_ROLES[turn.group(1)], "content": turn.group(2)}
+                for turn in _CONTEXT_TURN_RE.finditer(conversation_context)
+            ]
+            messages.extend(_trim_to_budget(history, _HISTORY_TOKEN_BUDGET))
+        
+        # Add current user message
+        messages.append({"role": "user", "content": user_message})
+        
+        payload = {**self._params_for(user_message), "model": self.model_name, "messages": messages}
+        if self.use_prompt_cache_key:
+            payload["prompt_cache_key"] = _CHAT_PROMPT_CACHE_KEY
+        elif self.use_cache_prompt:
+            payload["cache_prompt"] = True
+        return payload
+    
+    def _params_for(self, user_message: str) -> Mapping[str, Any]:
+        """Pick sampling settings and a reply length cap from the kind of message"""
+        if _TRIVIAL_RE.match(user_message):
+            return self._TRIVIAL_PAYLOAD
+        if self._is_factual_intent(user_message):
+            return self._FACTUAL_PAYLOAD
+        if _CONVERSATIONAL_RE.search(user_message):
+            return self._CONVERSATIONAL_PAYLOAD
+        return self._BASE_PAYLOAD
 
-            - RESPONSE TONE & STYLE:
-            • Be helpful, professional, and domain-appropriate
-            • Use clear formatting with actionable suggestions
-            • Adapt your response style to the user's question type
-            • For casual questions → Be conversational and welcoming
-            • For technical questions → Be precise and detailed
-            • For vague questions → Be guiding and educational
-            • Always prioritize data safety in operational guidance
-            • When asked about the current date, always refer to: {current_date}
+    def _response_cache_signature(self, user_message: str, user_id: str, has_history: bool) -> Optional[Tuple[str, str]]:
+        """Cache key for a chat answer, or None when the answer must not be reused.
 
-            - EXAMPLES OF APPROPRIATE RESPONSES:
-            User: "Hello" → "Hello! I'm your Cloud Inventory Log Management agent. I can help you view database statistics, check region connections, manage archiving operations, and explain safety procedures. What would you like to know about your log data?"
-            User: "What's the weather?" → "I'm specialized in Cloud Inventory Log Management and can't help with weather information. However, I can help you with database operations, viewing statistics, archiving procedures, and system health checks. What would you like to know about your log data?"
-            User: "Delete Database" → "I cannot and will not perform destructive database operations like deleting entire databases. I'm designed with safety-first principles and only support controlled archiving operations with built-in safeguards. My role is limited to safe data viewing and controlled archiving with multiple safety checks. Would you like to see table statistics or learn about our archiving procedures instead?"
-            User: "Drop table activities" → "I don't have permissions to drop tables or perform destructive schema operations. Table dropping is a dangerous operation that could cause data loss and is outside my mandate. I can help you with safe operations like viewing table statistics, archiving old records, or explaining our data retention policies. What would you like to know about the activities table?"
-            User: "Show me something" → "I'd be happy to show you information! Could you be more specific about what you'd like to see? For example:\n• 'Show activities statistics'\n• 'Count transactions from last month'\n• 'Display archive table information'\n• 'Show database health status'\n\nWhat type of data are you interested in?"
-            User: "Archive policy?" → "Our archiving policy includes several safety measures:\n• Records must be older than 7 days before archiving\n• Only archived records older than 30 days can be deleted\n• All operations require confirmation and are logged\n• Archive operations move data to dedicated archive tables (dsiactivitiesarchive, dsitransactionlogarchive)\n\nWould you like to see statistics for any specific table or learn about performing an archive operation?"
-            User: "Which region is connected?" → [Use region_status tool to show current region connections, available regions, and connection status for all regions]
-            Remember: Match your response style and detail level to the user's question type and apparent technical knowledge level."""
+        Only greedy (temperature 0) replies to users' context-free turns are cached; internal
+        "system" prompts and questions about the current date or time always go to the LLM.
+        """
+        if (has_history or user_id == "system" or _CLOCK_QUESTION_RE.search(user_message)
+                or self._params_for(user_message)["temperature"] != 0):
+            return None
+        return _response_signature(user_message, _formatted_now(int(time.time()))[0])
 
     async def generate_response(
         self, 
         user_message: str, 
         user_id: str,
         conversation_context: Optional[str] = None
-    ) -> Dict[str, Any]:
+    ) -> Mapping[str, Any]:
         """Generate response using the configured LLM with conversation memory"""
         try:
-            # Build the prompt with system context and conversation history
-            system_prompt = self.get_system_prompt()
-            
-            # Prepare messages for OpenAI chat format
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Add conversation context if available (includes previous exchanges)
-            if conversation_context and conversation_context != "No previous conversation history.":
-                # Parse conversation context into individual messages
-                if "Previous conversation:" in conversation_context:
-                    context_lines = conversation_context.split("\n")
-                    
-                    for line in context_lines:
-                        line = line.strip()
-                        if line.startswith("User: "):
-                            messages.append({"role": "user", "content": line[6:]})  # Remove "User: "
-                        elif line.startswith("Assistant: "):
-                            messages.append({"role": "assistant", "content": line[11:]})  # Remove "Assistant: "
-            
-            # Add current user message
-            messages.append({"role": "user", "content": user_message})
-            
-            # Use OpenAI API with requests
-            url = f"{self.base_url}/chat/completions"
-            
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 1000,
-                "top_p": 0.8
-            }
-            
-            response = requests.post(url, headers=self.headers, json=payload, timeout=60)
-            response.raise_for_status()
+            # Deterministic turns without history depend only on the message, so repeats are answered from cache
+            has_history = bool(conversation_context and "Previous conversation:" in conversation_context)
+            cache_signature = self._response_cache_signature(user_message, user_id, has_history)
+            if cache_signature is not None:
+                cached_text = _get_cached_response(cache_signature)
+                if cached_text is not None:
+                    return {
+                        "response": cached_text,
+                        "source": "response_cache"
+                    }
             
-            response_data = response.json()
+            # Use OpenAI API through the shared async client
+            payload = self._build_chat_payload(user_message, conversation_context, has_history)
+            response_data = await self._post_chat_completion(payload, timeout=60)
             response_text = response_data["choices"][0]["message"]["content"]
             
             if not response_text:
                 logger.warning("Empty response from OpenAI")
                 return self._get_fallback_response(user_message)
             
+            response_text = response_text.strip()
+            if cache_signature is not None:
+                _store_cached_response(cache_signature, response_text)
+            
             return {
-                "response": response_text.strip(),
+                "response": response_text,
                 "source": "openai"
             }
             
@@ -1315,6 +2089,44 @@ class OpenAIService:
             logger.error(f"OpenAI API error: {e}")
             return self._get_fallback_response(user_message, str(e))
     
+    async def stream_response(
+        self, 
+        user_message: str, 
+        user_id: str,
+        conversation_context: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Stream the generate_response reply as text chunks while the LLM produces them"""
+        streamed = []
+        try:
+            has_history = bool(conversation_context and "Previous conversation:" in conversation_context)
+            cache_signature = self._response_cache_signature(user_message, user_id, has_history)
+            if cache_signature is not None:
+                cached_text = _get_cached_response(cache_signature)
+                if cached_text is not None:
+                    yield cached_text
+                    return
+            
+            payload = self._build_chat_payload(user_message, conversation_context, has_history)
+            body = orjson.dumps({**payload, "stream": True})
+            with _openai_breaker.guard():
+                async with aclosing(self._iter_chat_stream(body, timeout=60)) as deltas:
+                    async for delta in deltas:
+                        streamed.append(delta)
+                        yield delta
+            
+            response_text = "".join(streamed).strip()
+            if not response_text:
+                logger.warning("Empty response from OpenAI")
+                yield self._get_fallback_response(user_message)["response"]
+            elif cache_signature is not None:
+                _store_cached_response(cache_signature, response_text)
+            
+        except Exception as e:
+            logger.error(f"OpenAI streaming error: {e}")
+            # Once text has reached the client it cannot be replaced, so only fall back before that
+            if not streamed:
+                yield self._get_fallback_response(user_message, str(e))["response"]
+    
     async def chat_completion(
         self, 
         messages: List[Dict[str, str]], 
@@ -1333,8 +2145,6 @@ class OpenAIService:
             OpenAI-compatible response format
         """
         try:
-            url = f"{self.base_url}/chat/completions"
-            
             payload = {
                 "model": self.model_name,
                 "messages": messages,
@@ -1343,10 +2153,7 @@ class OpenAIService:
                 "top_p": 0.9
             }
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            return response.json()
+            return await self._post_chat_completion(payload, timeout=30)
             
         except Exception as e:
             logger.error(f"Chat completion error: {e}")
@@ -1360,178 +2167,57 @@ class OpenAIService:
                 "error": str(e)
             }
         
-    def _get_fallback_response(self, user_message: str, error: Optional[str] = None) -> Dict[str, Any]:
+    def _get_fallback_response(self, user_message: str, error: Optional[str] = None) -> Mapping[str, Any]:
         """Provide contextual fallback response when OpenAI fails"""
-        error_msg = f" (Technical issue: {error})" if error else ""
-        
         # Analyze the user message to provide more contextual responses
         user_msg_lower = user_message.lower().strip()
         
+        return _build_fallback_response(self._get_fallback_intent(user_msg_lower), error)
+    
+    def _get_fallback_intent(self, user_msg_lower: str) -> str:
+        """Classify a lowercased message into one of the fallback response intents"""
         # Greeting patterns
-        if any(greeting in user_msg_lower for greeting in ['hello', 'hi', 'hey', 'good morning', 'good afternoon']):
-            return {
-                "response": f"Hello! I'm your Cloud Inventory Log Management agent{error_msg}. "
-                           "I'm here to help you manage your database operations safely and efficiently.\n\n"
-                           "What I can help with:\n"
-                           "• View database statistics and record counts\n"
-                           "• Guide archiving and data management operations\n"
-                           "• Explain safety policies and procedures\n"
-                           "• Monitor system health and performance\n\n"
-                           "What would you like to know about your log data?",
-                "suggestions": [
-                    "Show table statistics"
-                ],
-                "source": "fallback"
-            }
+        if _FALLBACK_GREETING_RE.search(user_msg_lower):
+            return "greeting"
         
         # Help or capability questions
-        elif any(help_word in user_msg_lower for help_word in ['help', 'what can you do', 'capabilities', 'features']):
-            return {
-                "response": f"I'm having trouble with my full response system right now{error_msg}, but I can still help! "
-                           "I'm specialized in Cloud Inventory Log Management with these capabilities:\n\n"
-                           "Data Operations:\n"
-                           "• View table statistics and record counts\n"
-                           "• Query specific data ranges and filters\n\n"
-                           "Archive Management:\n"
-                           "• Guide safe archiving procedures (7+ day old records)\n"
-                           "• Manage archive table operations\n\n"
-                           "Safety & Compliance:\n"
-                           "• Enforce data retention policies\n"
-                           "• Provide operation confirmations and logging\n\n"
-                           "Try asking me about specific tables or operations!",
-                "suggestions": [
-                    "Show table statistics"
-                ],
-                "source": "fallback"
-            }
+        elif _FALLBACK_HELP_RE.search(user_msg_lower):
+            return "help"
         
         # Database-related but vague requests
-        elif any(db_word in user_msg_lower for db_word in ['show', 'data', 'table', 'database', 'stats', 'count', 'archive']):
-            return {
-                "response": f"I'm experiencing some technical difficulties{error_msg}, but I can still assist with your database request! "
-                           "Could you be more specific about what you'd like to see?\n\n"
-                           "Available Tables:\n\n"
-                           "• dsiactivities - Current activity logs\n"
-                           "• dsitransactionlog - Current transaction logs\n"
-                           "• dsiactivitiesarchive - Archived activity logs\n"
-                           "• dsitransactionlogarchive - Archived transaction logs\n\n",
-                "suggestions": [
-                    "Show table statistics"
-                ],
-                "source": "fallback"
-            }
+        elif _FALLBACK_DATABASE_RE.search(user_msg_lower):
+            return "database"
         
         # Completely off-topic requests
-        elif not any(topic_word in user_msg_lower for topic_word in ['log', 'data', 'table', 'database', 'activity', 'transaction', 'archive']):
-            return {
-                "response": f"I'm having some technical issues right now{error_msg}. "
-                           "I'm specialized in Cloud Inventory Log Management and can't help with topics outside that domain. "
-                           "However, I'd be happy to help you with:\n\n"
-                           "My Specialties:\n"
-                           "• Database operations and statistics\n"
-                           "• Log data archiving and management\n"
-                           "• System safety and compliance procedures\n"
-                           "• Data retention policy guidance\n\n"
-                           "What would you like to know about your log management system?",
-                "suggestions": [
-                    "Show table statistics"
-                ],
-                "source": "fallback"
-            }
+        elif not _FALLBACK_TOPIC_RE.search(user_msg_lower):
+            return "off_topic"
         
         # Default fallback for unclear requests
-        else:
-            return {
-                "response": f"I'm experiencing some technical difficulties processing your request{error_msg}. "
-                           "I'm your Cloud Inventory Log Management agent and I'm here to help with database operations.\n\n"
-                           "How I can help:\n"
-                           "• View table statistics and record counts\n"
-                           "• Guide you through archiving procedures\n"  
-                           "• Explain safety rules and best practices\n"
-                           "• Monitor system health and performance\n\n"
-                           "Could you try rephrasing your request",
-                "suggestions": [
-                    "Show table statistics"
-                ],
-                "source": "fallback"
-            }
+        return "default"
     
     def _has_custom_date_range(self, user_msg_lower: str) -> bool:
         """Check if the message contains a custom date range pattern"""
-        import re
-        
-        # Patterns for date ranges
-        patterns = [
-            r'september\s+\d+\s+to\s+september\s+\d+',  # "september 15 to september 30"
-            r'from\s+september\s+\d+\s+to\s+september\s+\d+',  # "from september 15 to september 30"
-            r'\d+/\d+\s+(?:and|to)\s+\d+/\d+',  # "9/15 and 9/30" or "9/15 to 9/30"
-            r'between\s+\d+/\d+\s+and\s+\d+/\d+',  # "between 9/15 and 9/30"
-            r'get\s+all\s+jobs\s+between\s+\d+/\d+\s+and\s+\d+/\d+',  # "get all jobs between 9/15 and 9/30"
-            r'october\s+\d+\s+to\s+october\s+\d+',  # "october 1 to october 3"
-            r'from\s+october\s+\d+\s+to\s+october\s+\d+',  # "from october 1 to october 3"
-            r'from\s+\d+/\d+\s+to\s+\d+/\d+',  # "from 9/15 to 9/30"
-            r'jobs\s+from\s+\d+/\d+\s+to\s+\d+/\d+',  # "jobs from 9/15 to 9/30"
-        ]
-        
-        for pattern in patterns:
-            if re.search(pattern, user_msg_lower):
+        for pattern in _CUSTOM_DATE_RANGE_PATTERNS:
+            if pattern.search(user_msg_lower):
                 return True
         return False
     
     def _extract_custom_date_range(self, user_message: str) -> str:
         """Extract and format custom date range from user message"""
-        import re
-        from datetime import datetime
-        
         user_msg_lower = user_message.lower()
         current_year = datetime.now().year
         
-        # Pattern 1: "september 15 to september 30" or "from september 15 to september 30"
-        pattern1 = r'(?:from\s+)?september\s+(\d+)\s+to\s+september\s+(\d+)'
-        match1 = re.search(pattern1, user_msg_lower)
-        if match1:
-            start_day = match1.group(1)
-            end_day = match1.group(2)
-            return f"from_9/{start_day}/{current_year}_to_9/{end_day}/{current_year}"
-        
-        # Pattern 2: "9/15 and 9/30" or "9/15 to 9/30" or "between 9/15 and 9/30" or "from 9/15 to 9/30"
-        pattern2 = r'(?:between\s+|from\s+)?(\d+)/(\d+)\s+(?:and|to)\s+(\d+)/(\d+)'
-        match2 = re.search(pattern2, user_msg_lower)
-        if match2:
-            start_month = match2.group(1)
-            start_day = match2.group(2)
-            end_month = match2.group(3)
-            end_day = match2.group(4)
-            return f"from_{start_month}/{start_day}/{current_year}_to_{end_month}/{end_day}/{current_year}"
-        
-        # Pattern 3: "october 1 to october 3" or "from october 1 to october 3"
-        pattern3 = r'(?:from\s+)?october\s+(\d+)\s+to\s+october\s+(\d+)'
-        match3 = re.search(pattern3, user_msg_lower)
-        if match3:
-            start_day = match3.group(1)
-            end_day = match3.group(2)
-            return f"from_10/{start_day}/{current_year}_to_10/{end_day}/{current_year}"
-        
-        # Pattern 4: "jobs from M/D to M/D"
-        pattern4 = r'jobs\s+from\s+(\d+)/(\d+)\s+to\s+(\d+)/(\d+)'
-        match4 = re.search(pattern4, user_msg_lower)
-        if match4:
-            start_month = match4.group(1)
-            start_day = match4.group(2)
-            end_month = match4.group(3)
-            end_day = match4.group(4)
-            return f"from_{start_month}/{start_day}/{current_year}_to_{end_month}/{end_day}/{current_year}"
+        for pattern, template in _CUSTOM_DATE_RANGE_RULES:
+            match = pattern.search(user_msg_lower)
+            if match:
+                return template.format(*match.groups(), year=current_year)
         
         # Default fallback - couldn't parse the date range
-        import logging
-        logger = logging.getLogger(__name__)
         logger.warning(f"Could not parse custom date range from: {user_message}")
         return "today"  # Fallback to today
     
     def _extract_table_names_from_sql(self, sql_query: str) -> List[str]:
         """Extract table names from SQL query"""
-        import re
-        
         if not sql_query:
             return []
         
@@ -1541,33 +2227,25 @@ class OpenAIService:
         tables = []
         
         # Extract all table names from FROM and JOIN clauses
-        from_pattern = r'\bFROM\s+([a-zA-Z_][a-zA-Z0-9_]*)'
-        join_pattern = r'\b(?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN\s+([a-zA-Z_][a-zA-Z0-9_]*)'
-        
         # Find all FROM matches
-        from_matches = re.findall(from_pattern, sql_upper)
+        from_matches = _SQL_FROM_RE.findall(sql_upper)
         tables.extend([match.lower() for match in from_matches])
         
         # Find all JOIN matches
-        join_matches = re.findall(join_pattern, sql_upper)
+        join_matches = _SQL_JOIN_RE.findall(sql_upper)
         tables.extend([match.lower() for match in join_matches])
         
         # Filter to only include our known database tables
-        known_tables = [
-            'dsiactivities', 'dsitransactionlog', 'job_logs',
-            'dsiactivitiesarchive', 'dsitransactionlogarchive'
-        ]
-        
         filtered_tables = []
         for table in tables:
-            if table in known_tables:
+            if table in _KNOWN_SQL_TABLES:
                 filtered_tables.append(table)
             # Also check if it contains our table names (for aliases like 'a' for activities)
-            elif any(known in table for known in known_tables):
+            elif any(known in table for known in _KNOWN_SQL_TABLES):
                 filtered_tables.append(table)
         
-        # Remove duplicates and return
-        return list(set(filtered_tables))
+        # Remove duplicates, keeping FROM tables ahead of JOIN tables for the primary-table pick
+        return list(dict.fromkeys(filtered_tables))
     
     def _extract_primary_table_from_sql(self, sql_query: str) -> str:
         """Extract the primary table name from SQL query (FROM clause)"""
@@ -1,12 +1,12 @@
 """Region and database connection management service"""
 import logging
 import os
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterator, Optional, Tuple
 from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.engine import Engine
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 from shared.enums import TableName
 from database import get_db
 from services.region_config_service import get_region_config_service
@@ -16,6 +16,10 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Per-region connection pool sizing; sessions borrow from and return to this pool
+REGION_POOL_SIZE = int(os.getenv("REGION_DB_POOL_SIZE", "5"))
+REGION_POOL_MAX_OVERFLOW = int(os.getenv("REGION_DB_MAX_OVERFLOW", "10"))
+
 class RegionService:
     """Service for managing regional database connections"""
     
@@ -87,6 +91,8 @@ class RegionService:
             # Create engine
             engine = create_engine(
                 database_url,
+                pool_size=REGION_POOL_SIZE,
+                max_overflow=REGION_POOL_MAX_OVERFLOW,
                 pool_pre_ping=True,
                 pool_recycle=3600,
                 echo=False
@@ -175,6 +181,15 @@ class RegionService:
             logger.error(f"Failed to get session for region {region}: {e}")
             raise
     
+    @contextmanager
+    def session_scope(self, region: str) -> Iterator[Session]:
+        """Borrow a pooled session for a region and always return its connection to the pool"""
+        session = self.get_session(region)
+        try:
+            yield session
+        finally:
+            session.close()
+    
     def is_connected(self, region: str) -> bool:
         """Check if connected to a specific region"""
         return self.connection_status.get(region, False)
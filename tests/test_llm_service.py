@@ -0,0 +1,290 @@
+"""Tests for the LLM service helpers that run without a network or database"""
+import asyncio
+import time
+from contextlib import contextmanager
+
+import httpx
+import orjson
+import pytest
+
+from services import llm_service
+from services.llm_service import _is_non_database_message
+
+
+@pytest.mark.parametrize("message", [
+    "hello",
+    "Hi!",
+    "good morning",
+    "what can you do?",
+    "what is today's date?",
+    "what's the weather like",
+    "tell me a joke",
+    "drop the table dsiactivities",
+    "what is the archive policy?",
+    "thanks",
+])
+def test_non_database_messages_skip_routing(message):
+    assert _is_non_database_message(message, has_context=False)
+
+
+@pytest.mark.parametrize("message", [
+    "hello, show me errors from yesterday",
+    "hey, any failures today?",
+    "help me find failed logs",
+    "help me list all warnings",
+    "show failed logs for the stocks feed",
+    "show errors from the news service",
+    "how many records are in dsiactivities",
+    "archive activities older than 30 days",
+    "what is the archive policy for records older than 30 days?",
+])
+def test_data_requests_are_routed(message):
+    assert not _is_non_database_message(message, has_context=False)
+
+
+def test_acknowledgement_is_routed_only_with_history():
+    assert _is_non_database_message("ok", has_context=False)
+    assert not _is_non_database_message("ok", has_context=True)
+
+
+class _FakeRegionService:
+    @contextmanager
+    def session_scope(self, region):
+        yield None
+
+
+def _stats_service(on_query=None):
+    """DatabaseService stand-in whose stats query counts calls and runs on_query mid-query"""
+    calls = []
+
+    class _FakeDatabaseService:
+        def __init__(self, session):
+            pass
+
+        async def get_detailed_table_stats(self):
+            calls.append(1)
+            if on_query:
+                on_query()
+            return {"success": True, "tables": {"dsiactivities": {"count": len(calls)}}}
+
+    return _FakeDatabaseService, calls
+
+
+@pytest.fixture
+def stats_cache(monkeypatch):
+    monkeypatch.setattr(llm_service, "get_region_service", lambda: _FakeRegionService())
+    llm_service.invalidate_table_stats_cache()
+    yield
+    llm_service.invalidate_table_stats_cache()
+
+
+def test_table_stats_are_cached_and_returned_as_copies(stats_cache, monkeypatch):
+    service, calls = _stats_service()
+    monkeypatch.setattr(llm_service, "DatabaseService", service)
+
+    first = asyncio.run(llm_service._detailed_table_stats("us"))
+    first["tables"]["dsiactivities"]["count"] = 999
+    second = asyncio.run(llm_service._detailed_table_stats("us"))
+
+    assert len(calls) == 1
+    assert second["tables"]["dsiactivities"]["count"] == 1
+
+
+def test_invalidation_during_a_running_query_is_not_overwritten(stats_cache, monkeypatch):
+    service, calls = _stats_service(on_query=llm_service.invalidate_table_stats_cache)
+    monkeypatch.setattr(llm_service, "DatabaseService", service)
+
+    asyncio.run(llm_service._detailed_table_stats("us"))
+
+    assert "us" not in llm_service._db_stats_cache
+
+
+def _sse(text):
+    chunk = orjson.dumps({"choices": [{"delta": {"content": text}}]}).decode()
+    return f"data: {chunk}\n\ndata: [DONE]\n\n".encode()
+
+
+class _SlowBody(httpx.AsyncByteStream):
+    """Stream body that waits before sending its text and records whether it was closed early"""
+
+    def __init__(self, text, delay):
+        self.text = text
+        self.delay = delay
+        self.finished = False
+        self.closed = False
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.delay)
+        self.finished = True
+        yield _sse(self.text)
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture
+def mock_openai(monkeypatch):
+    """Route the shared HTTP client to a handler; each test lists the replies in call order"""
+    replies = []
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        return replies[len(requests) - 1]()
+
+    monkeypatch.setattr(llm_service, "_openai_breaker", llm_service._CircuitBreaker(fail_max=5, reset_timeout=30))
+    monkeypatch.setattr(llm_service, "_HEDGE_AFTER_SECONDS", 0.05)
+    monkeypatch.setattr(llm_service, "_HEDGE_DEADLINE_SECONDS", 1.0)
+    monkeypatch.setattr(llm_service, "_http_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return replies, requests
+
+
+def _stream_routing_reply():
+    service = llm_service.OpenAIService()
+    payload = {"model": "test", "temperature": 0, "messages": []}
+    return service._stream_chat_completion(payload, timeout=5, is_complete=lambda text: False)
+
+
+def test_hedged_request_wins_and_the_slow_copy_is_cancelled(mock_openai):
+    replies, requests = mock_openai
+    slow = _SlowBody("slow", delay=0.5)
+    replies.append(lambda: httpx.Response(200, stream=slow))
+    replies.append(lambda: httpx.Response(200, content=_sse("fast")))
+
+    async def run():
+        text = await _stream_routing_reply()
+        await asyncio.sleep(0.05)
+        return text
+
+    assert asyncio.run(run()) == "fast"
+    assert len(requests) == 2
+    assert slow.closed and not slow.finished
+
+
+def test_hedged_requests_give_up_at_the_deadline(mock_openai, monkeypatch):
+    replies, requests = mock_openai
+    monkeypatch.setattr(llm_service, "_HEDGE_DEADLINE_SECONDS", 0.2)
+    replies.extend([lambda: httpx.Response(200, stream=_SlowBody("late", delay=5))] * 2)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_stream_routing_reply())
+    assert len(requests) == 2
+
+
+def test_no_hedge_while_the_first_copy_backs_off(mock_openai):
+    replies, requests = mock_openai
+    replies.append(lambda: httpx.Response(429, headers={"retry-after": "0.2"}))
+    replies.append(lambda: httpx.Response(200, content=_sse("after backoff")))
+
+    started = time.monotonic()
+    assert asyncio.run(_stream_routing_reply()) == "after backoff"
+    # The retry, not a hedge sent during the backoff, made the second request
+    assert time.monotonic() - started >= 0.2
+    assert len(requests) == 2
+
+
+class _FailingBody(httpx.AsyncByteStream):
+    """Stream body whose connection drops after a delay"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.delay)
+        raise httpx.ReadError("connection reset")
+        yield b""
+
+
+def test_hedged_copies_count_as_one_breaker_failure(mock_openai):
+    replies, requests = mock_openai
+
+    def refuse():
+        raise httpx.ConnectError("connection refused")
+
+    replies.append(lambda: httpx.Response(200, stream=_FailingBody(delay=0.2)))
+    replies.append(refuse)
+
+    with pytest.raises(httpx.HTTPError):
+        asyncio.run(_stream_routing_reply())
+    assert len(requests) == 2
+    assert llm_service._openai_breaker.failures == 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_service.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _fail(breaker, error=None):
+    with pytest.raises(Exception):
+        with breaker.guard():
+            raise error or httpx.ConnectError("connection refused")
+
+
+def _status_error(status_code):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(status_code, request=request))
+
+
+def test_breaker_opens_then_closes_after_a_successful_trial(clock):
+    breaker = llm_service._CircuitBreaker(fail_max=2, reset_timeout=30)
+    _fail(breaker)
+    assert breaker.state == "closed"
+    _fail(breaker)
+    assert breaker.state == "open"
+
+    with pytest.raises(llm_service._CircuitOpenError):
+        with breaker.guard():
+            pass
+
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    with breaker.guard():
+        # Only the trial goes through while it runs
+        with pytest.raises(llm_service._CircuitOpenError):
+            with breaker.guard():
+                pass
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_failed_trial_reopens_the_breaker(clock):
+    breaker = llm_service._CircuitBreaker(fail_max=1, reset_timeout=30)
+    _fail(breaker)
+    clock[0] += 30
+    _fail(breaker, _status_error(503))
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock[0]
+
+
+def test_trial_answered_with_a_client_error_closes_the_breaker(clock):
+    breaker = llm_service._CircuitBreaker(fail_max=1, reset_timeout=30)
+    _fail(breaker)
+    clock[0] += 30
+    _fail(breaker, _status_error(400))
+    assert breaker.state == "closed"
+
+
+def test_cancelled_trial_lets_the_next_call_try(clock):
+    breaker = llm_service._CircuitBreaker(fail_max=1, reset_timeout=30)
+    _fail(breaker)
+    clock[0] += 30
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.guard():
+            raise asyncio.CancelledError()
+    assert breaker.state == "half_open"
+    with breaker.guard():
+        pass
+    assert breaker.state == "closed"
+
+
+@pytest.mark.parametrize("sql, table", [
+    ("SELECT * FROM dsiactivities a JOIN dsitransactionlog t ON a.id = t.id", "dsiactivities"),
+    ("SELECT * FROM dsiactivitiesarchive JOIN dsitransactionlog ON 1 = 1", "dsitransactionlog"),
+    ("select count(*) from job_logs", "job_logs"),
+    ("SELECT * FROM users", None),
+])
+def test_primary_table_is_taken_from_the_sql(sql, table):
+    assert llm_service.OpenAIService()._extract_primary_table_from_sql(sql) == table